@@ -0,0 +1,261 @@
+""" Headless benchmarks for the TileMap library.
+
+Runs under SDL's dummy video driver, so no window or mouse is needed.
+Every result is printed as one JSON object per line, for comparing between releases:
+    {"bench": ..., "params": {...}, "ops": ..., "seconds": ..., "us_per_op": ..., "peak_kib": ...}
+peak_kib is the peak of Python allocations during one extra, traced run (tracemalloc),
+which doesn't see pixel memory SDL allocates itself. the last line has the process's max RSS.
+
+usage: python bench.py [--quick] [--out bench_output.txt] [--no-memory] [load draw picking movement paths]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import tilemap
+
+LOAD_SIZES = (4, 16, 64, 256, 1024, 4096)
+TILES_MAX_SIZE = 1024 # a Tile per cell gets into gigabytes past this.
+VIEWPORT_SIZES = ((320, 240), (640, 351), (1280, 720), (1920, 1080))
+DRAW_FRAMES = 200
+PICKING_POINTS = 20000
+# map_offset while picking: where it starts, whole floats as map_move leaves it, and mid-scroll.
+PICKING_OFFSETS = ((0, 0), (-32.0, 16.0), (-16.5, 8.25))
+MOVEMENT_STEPS = 200
+PATH_QUERIES = 300
+PATH_LIMIT = 2000
+
+def measure(bench, params, run, ops=1, memory=True, warmup=False):
+    """ times run() doing ops operations, then runs it again under tracemalloc for its peak.
+    warmup runs it once first, untimed, e.g. to fill caches. returns the result as a dict. """
+    if warmup:
+        run()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    result = {
+        "bench": bench,
+        "params": params,
+        "ops": ops,
+        "seconds": round(seconds, 6),
+        "us_per_op": round(seconds / ops * 1e6, 3),
+    }
+    if memory:
+        tracemalloc.start()
+        run()
+        result["peak_kib"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return result
+
+def write_level(path, size, walls=0.2, seed=0):
+    """ a size x size text level, floor with walls scattered around it. """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for y in range(size):
+            f.write("".join("#" if rng.random() < walls else "0" for x in range(size)) + "\n")
+    return path
+
+def make_map(screen, viewport, level, **options):
+    return tilemap.TileMap(screen, tilemap.Vec2d(*viewport), True, level, **options)
+
+def bench_load(screen, workdir, sizes, memory):
+    """ generate_terrain_layer() for text and binary levels with both storages. """
+    for size in sizes:
+        text_level = write_level(os.path.join(workdir, f"load{size}.txt"), size)
+        binary_level = os.path.join(workdir, f"load{size}.tmap")
+        tilemap.convert_text_level(text_level, binary_level)
+        for storage in ("tiles", "arrays"):
+            if storage == "tiles" and size > TILES_MAX_SIZE:
+                continue
+            # small maps load in microseconds, so they're loaded several times to be measurable.
+            repeat = max(1, min(100, 65536 // (size * size)))
+            for kind, level in (("text", text_level), ("binary", binary_level)):
+                area = make_map(screen, (640, 351), level, storage=storage)
+                def run():
+                    for i in range(repeat):
+                        area.map_loaded = False
+                        area.generate_terrain_layer()
+                yield measure("load", {"size": size, "storage": storage, "format": kind}, run, repeat, memory)
+                del area
+
+def bench_draw(screen, workdir, viewports, frames, memory):
+    """ draw() of a 256x256 map at each viewport size, panning a few pixels every frame
+    so that nothing can be skipped. the modes drawing from cached chunks also report
+    chunk_misses_per_frame, chunks rendered again because the cache lost them,
+    which should stay near 0 whatever the viewport size. """
+    level = write_level(os.path.join(workdir, "draw.txt"), 256)
+    modes = {
+        "chunks": {},
+        "tiles": {"chunk_size": 0},
+        "scroll_buffer": {"scroll_buffer": True},
+        "dirty_rects": {"dirty_rects": True},
+    }
+    for width, height in viewports:
+        surf = pygame.Surface((width, height))
+        for mode, options in modes.items():
+            area = make_map(surf, (width, height), level, storage="arrays", **options)
+            area.center_on(tilemap.Vec2d(128, 128))
+            start = tilemap.Vec2d(area.map_offset.x, area.map_offset.y)
+            def run():
+                for frame in range(frames):
+                    area.map_offset = tilemap.Vec2d(start.x + frame % 64 * 2, start.y + frame % 64)
+                    area.dirty_all = True
+                    area.draw()
+            result = measure("draw", {"viewport": [width, height], "mode": mode}, run, frames, memory, warmup=True)
+            if area.chunk_size:
+                area.enable_stats(history=frames)
+                for frame in range(frames):
+                    area.map_offset = tilemap.Vec2d(start.x + frame % 64 * 2, start.y + frame % 64)
+                    area.dirty_all = True
+                    area.draw()
+                    area.end_frame()
+                misses = sum(record["counts"].get("chunk_cache_misses", 0) for record in area.stats.history)
+                result["chunk_misses_per_frame"] = round(misses / frames, 3)
+                area.disable_stats()
+            yield result
+
+def bench_picking(screen, workdir, points, memory):
+    """ pixelxy_to_world_coord and pixelxy_to_tilexy on random screen positions,
+    and their batch versions when numpy is around, at each of PICKING_OFFSETS. """
+    level = write_level(os.path.join(workdir, "picking.txt"), 256)
+    area = make_map(screen, (640, 351), level, storage="arrays")
+    rng = random.Random(1)
+    positions = [tilemap.Vec2d(rng.randrange(640), rng.randrange(351)) for i in range(points)]
+    try:
+        import numpy as np
+        batch = np.array([(position.x, position.y) for position in positions])
+    except ImportError:
+        batch = None
+    for offset in PICKING_OFFSETS:
+        area.map_offset = tilemap.Vec2d(*offset)
+        for name in ("pixelxy_to_world_coord", "pixelxy_to_tilexy"):
+            pick = getattr(area, name)
+            def run():
+                for position in positions:
+                    pick(position)
+            yield measure("picking", {"function": name, "map_offset": list(offset)}, run, points, memory)
+        if batch is None:
+            continue
+        for name in ("pixelxy_to_world_coord_batch", "pixelxy_to_tilexy_batch"):
+            pick = getattr(area, name)
+            yield measure("picking", {"function": name, "map_offset": list(offset)},
+                lambda: pick(batch), points, memory)
+
+def bench_movement(screen, workdir, steps, memory):
+    """ a scripted walk: map_move() in a loop of directions, then update() and draw()
+    every frame until each move's animation is over. ops are frames. """
+    level = write_level(os.path.join(workdir, "movement.txt"), 256, walls=0)
+    script = ["north", "east", "south", "west", "up", "left", "down", "right"]
+    for storage in ("tiles", "arrays"):
+        area = make_map(screen, (640, 351), level, storage=storage)
+        frames = [0]
+        def run():
+            area.center_on(tilemap.Vec2d(128, 128))
+            frames[0] = 0
+            for step in range(steps):
+                area.map_move(script[step % len(script)])
+                while True:
+                    area.update()
+                    area.draw()
+                    frames[0] += 1
+                    if not area.moving:
+                        break
+        result = measure("movement", {"storage": storage, "steps": steps}, run, 1, memory)
+        result["ops"] = frames[0]
+        result["us_per_op"] = round(result["seconds"] / frames[0] * 1e6, 3)
+        yield result
+
+def bench_paths(screen, workdir, queries, memory):
+    """ find_path() throughput on a 512x512 map with 20% walls, with the path cache off:
+    short queries (goals up to 20 tiles away), long ones (anywhere on the map),
+    and long ones with the search limited to PATH_LIMIT tiles. ops are queries. """
+    level = write_level(os.path.join(workdir, "paths.txt"), 512)
+    area = make_map(screen, (640, 351), level, storage="arrays", headless=True)
+    area.path_cache_size = 0
+    collision = area.map_collision_layer
+    rng = random.Random(2)
+    def walkable_near(x, y, reach):
+        while True:
+            location = tilemap.Vec2d(
+                min(max(x + rng.randint(-reach, reach), 0), 511), min(max(y + rng.randint(-reach, reach), 0), 511))
+            if collision.is_static(location.x, location.y):
+                return location
+    short = []
+    long = []
+    for i in range(queries):
+        start = walkable_near(256, 256, 256)
+        short.append((start, walkable_near(start.x, start.y, 20)))
+    for i in range(max(queries // 10, 1)):
+        long.append((walkable_near(256, 256, 256), walkable_near(256, 256, 256)))
+    for name, pairs, limit in (("short", short, None), ("long", long, None), ("long_limited", long, PATH_LIMIT)):
+        def run():
+            for start, goal in pairs:
+                area.find_path(start, goal, limit)
+        yield measure("paths", {"queries": name, "limit": limit}, run, len(pairs), memory, warmup=True)
+
+BENCHES = {
+    "load": lambda screen, workdir, args: bench_load(
+        screen, workdir, LOAD_SIZES[:4] if args.quick else LOAD_SIZES, args.memory),
+    "draw": lambda screen, workdir, args: bench_draw(
+        screen, workdir, VIEWPORT_SIZES[::2] if args.quick else VIEWPORT_SIZES,
+        DRAW_FRAMES // 10 if args.quick else DRAW_FRAMES, args.memory),
+    "picking": lambda screen, workdir, args: bench_picking(
+        screen, workdir, PICKING_POINTS // 10 if args.quick else PICKING_POINTS, args.memory),
+    "movement": lambda screen, workdir, args: bench_movement(
+        screen, workdir, MOVEMENT_STEPS // 10 if args.quick else MOVEMENT_STEPS, args.memory),
+    "paths": lambda screen, workdir, args: bench_paths(
+        screen, workdir, PATH_QUERIES // 10 if args.quick else PATH_QUERIES, args.memory),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="headless TileMap benchmarks, one JSON result per line.")
+    parser.add_argument("benches", nargs="*",
+        help=f"which benchmarks to run out of {', '.join(BENCHES)}, all of them by default")
+    parser.add_argument("--quick", action="store_true", help="smaller maps and fewer frames, for a smoke test")
+    parser.add_argument("--out", help="also write the results to this file")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced memory runs")
+    args = parser.parse_args()
+    for name in args.benches:
+        if name not in BENCHES:
+            parser.error(f"unknown benchmark {name}")
+
+    pygame.display.init()
+    screen = pygame.display.set_mode((640, 480))
+    out = open(args.out, "w") if args.out else None
+    def emit(result):
+        line = json.dumps(result)
+        print(line, flush=True)
+        if out:
+            out.write(line + "\n")
+            out.flush()
+
+    emit({"bench": "environment", "python": platform.python_version(), "pygame": pygame.version.ver,
+          "sdl": ".".join(map(str, pygame.get_sdl_version())), "platform": platform.platform()})
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.benches or BENCHES:
+            for result in BENCHES[name](screen, workdir, args):
+                emit(result)
+    try:
+        import resource
+        # kilobytes on linux, bytes on macOS.
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        emit({"bench": "process", "max_rss_kib": max_rss // 1024 if sys.platform == "darwin" else max_rss})
+    except ImportError: # windows
+        pass
+    if out:
+        out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+""" Converts text levels (like levels/lvl.txt) to the binary level format
+that TileMap memory-maps instead of parsing.
+
+usage: python convert_level.py levels/lvl.txt levels/lvl.tmap
+"""
+
+import sys
+
+import tilemap
+
+if len(sys.argv) != 3:
+    print(__doc__)
+    sys.exit(1)
+
+def show_progress(rows_done, rows_total):
+    if rows_done % 256 == 0 or rows_done == rows_total:
+        print(f"\r{rows_done} / {rows_total} rows", end="", flush=True)
+
+tilemap.convert_text_level(sys.argv[1], sys.argv[2], progress=show_progress)
+print()
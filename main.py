@@ -14,6 +14,8 @@ keeping the selection at the location of the last valid tile.
 pathfinding algorithm.
 """
 
+import os
+
 import pygame
 from pygame.locals import *
 
@@ -46,8 +48,10 @@ HUD["y"] = screen_size.y - HUD["height"]
 HUD["width"] = screen_size.x
 
 # arguments: drawing surface | viewport size | fixed or dynamic map | level file
-# last argument is optional - defaults to "levels\\lvl.txt" if fixed is False.
-starting_area = tilemap.TileMap(screen, viewport_size, True, "levels\\lvl.txt")
+# last argument is optional - defaults to levels/lvl.txt if fixed is False.
+starting_area = tilemap.TileMap(screen, viewport_size, True, os.path.join(tilemap.LEVEL_DIR, "lvl.txt"))
+# per-frame timings, shown in the top right with F3. only recorded while shown.
+show_stats = False
 
 player = tilemap.Tile(starting_area.terrain_sprites["filled"], 288, 144, False)
 #endregion
@@ -60,12 +64,12 @@ running = True
 while running:
 
     screen.fill(white)
-    timer.tick(FPS)
+    elapsed = timer.tick(FPS) / 1000 # seconds since the last frame.
     
     # placed in my own data type because getting x and y with 0 and 1 is weird :/
     mouse = tilemap.Vec2d(pygame.mouse.get_pos()[0], pygame.mouse.get_pos()[1])
 
-    starting_area.update()
+    starting_area.update(elapsed)
 
     #region drawing and debugging
 
@@ -73,8 +77,9 @@ while running:
     starting_area.draw()
     
     # debug: display a highlighted tile where the mouse is.
-    world_coords_at_mouse = starting_area.pixelxy_to_world_coord(mouse) # world coord of tile.
-    tilexy_under_mouse = starting_area.pixelxy_to_tilexy(mouse) # pixel coord of tile.
+    with starting_area.phase("picking"):
+        world_coords_at_mouse = starting_area.pixelxy_to_world_coord(mouse) # world coord of tile.
+        tilexy_under_mouse = starting_area.pixelxy_to_tilexy(mouse) # pixel coord of tile.
     starting_area.draw_at_position(starting_area.terrain_sprites["filled"], tilexy_under_mouse)
     
     # debug: display a highlighted tile where the viewport center is.
@@ -91,23 +96,24 @@ while running:
         starting_area.map_center_tile().y, 
         starting_area.tile_size.x, starting_area.tile_size.y), 2)
 
-    # display some debugging info about the map coordinates
-    mouse_cursor_text_surf = font.render(
-        f"Mouse : {mouse.x}, {mouse.y}", True, black)
-    cell_text_surf = font.render(
-        f"Cell : {mouse.x // starting_area.tile_size.x}, {mouse.y // starting_area.tile_size.y}", True, black)
-    selected_world_coords_text_surf = font.render(
-        f"World : {int(world_coords_at_mouse.x)}, {int(world_coords_at_mouse.y)}", True, black)
-    tilexy_under_mouse_surf = font.render(
-        f"Selected : {tilexy_under_mouse.x}, {tilexy_under_mouse.y}", True, black)
-    player_location_surf = font.render(
-        f"Player Loc : {starting_area.map_player_location.x}, {starting_area.map_player_location.y}", True, black)
-
-    screen.blit(mouse_cursor_text_surf, (12, 12))
-    screen.blit(cell_text_surf, (12, 36))
-    screen.blit(selected_world_coords_text_surf, (12, 60))
-    screen.blit(tilexy_under_mouse_surf, (12, 84))
-    screen.blit(player_location_surf, (12, 108))
+    with starting_area.phase("overlay"):
+        # display some debugging info about the map coordinates
+        mouse_cursor_text_surf = font.render(
+            f"Mouse : {mouse.x}, {mouse.y}", True, black)
+        cell_text_surf = font.render(
+            f"Cell : {mouse.x // starting_area.tile_size.x}, {mouse.y // starting_area.tile_size.y}", True, black)
+        selected_world_coords_text_surf = font.render(
+            f"World : {int(world_coords_at_mouse.x)}, {int(world_coords_at_mouse.y)}", True, black)
+        tilexy_under_mouse_surf = font.render(
+            f"Selected : {tilexy_under_mouse.x}, {tilexy_under_mouse.y}", True, black)
+        player_location_surf = font.render(
+            f"Player Loc : {starting_area.map_player_location.x}, {starting_area.map_player_location.y}", True, black)
+
+        screen.blit(mouse_cursor_text_surf, (12, 12))
+        screen.blit(cell_text_surf, (12, 36))
+        screen.blit(selected_world_coords_text_surf, (12, 60))
+        screen.blit(tilexy_under_mouse_surf, (12, 84))
+        screen.blit(player_location_surf, (12, 108))
 
     # draw HUD on top of everything else
     pygame.draw.rect(screen, "black", (HUD["x"], HUD["y"], HUD["width"], HUD["height"]), 1)
@@ -162,8 +168,19 @@ while running:
         if event.type == MOUSEBUTTONUP: 
             if event.button == LEFT_MB: 
                 clicking = False
+        if event.type == KEYDOWN:
+            if event.key == K_F3:
+                show_stats = not show_stats
+                if show_stats:
+                    starting_area.enable_stats()
+                else:
+                    starting_area.disable_stats()
     #endregion
 
+    if show_stats:
+        starting_area.draw_stats(position=tilemap.Vec2d(400, 12))
+    starting_area.end_frame()
+
     pygame.display.update()
 #endregion
 
@@ -0,0 +1,44 @@
+""" checks for TileMap, run with pytest. headless-safe: uses SDL's dummy video driver. """
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import pytest
+
+import tilemap
+
+@pytest.fixture(scope="module")
+def screen():
+    pygame.init()
+    yield pygame.display.set_mode((640, 351))
+    pygame.quit()
+
+def walled_level(path):
+    """ a 40x40 open level with a wall across the player's sight east of (20, 20). """
+    rows = [["0"] * 40 for y in range(40)]
+    for y in range(15, 26):
+        rows[y][22] = "#"
+    path.write_text("".join(f"{''.join(row)}\n" for row in rows))
+    return str(path)
+
+def test_dirty_rect_fog_matches_full_redraw_after_collision_edit(screen, tmp_path):
+    level = walled_level(tmp_path / "walled.txt")
+    size = tilemap.Vec2d(640, 351)
+    dirty = tilemap.TileMap(pygame.Surface((640, 351)), size, True, level, dirty_rects=True, fov_radius=8)
+    full = tilemap.TileMap(pygame.Surface((640, 351)), size, True, level, fov_radius=8)
+    for area in (dirty, full):
+        area.center_on(tilemap.Vec2d(20, 20))
+        area.drawing_surf.fill(area.background_color)
+        area.draw()
+    dirty.draw() # settle, so only the edit is dirty on the next frame.
+
+    # opening the wall lets the player see the tiles behind it, outside the edited tile's rect.
+    for area in (dirty, full):
+        area.draw_at_location(area.terrain_sprites["default"], tilemap.Vec2d(22, 20))
+    dirty.draw()
+    full.drawing_surf.fill(full.background_color)
+    full.draw()
+
+    assert full.fov.is_visible(23, 20)
+    assert pygame.image.tobytes(dirty.drawing_surf, "RGB") == pygame.image.tobytes(full.drawing_surf, "RGB")
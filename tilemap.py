@@ -12,30 +12,1036 @@ TODO:
   keeping the selection at the location of the last valid tile.
 """
 
-import pygame
+import bisect
+import gc
+import heapq
+import importlib
+import math
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import time
+import weakref
+from array import array
+from collections import OrderedDict, deque
+from contextlib import nullcontext
 
-pygame.init()
+#region lazy imports
+# importing pygame takes longer than everything else here put together, and tools that
+# only need Vec2d, coordinate math or level files never touch it. so pygame is only imported
+# the first time something in it is used, and nothing is initialized at import at all:
+# the library only uses parts of pygame that don't need pygame.init() (surfaces, rects,
+# image loading), starts the font module itself when draw_stats() needs it,
+# and leaves the display to the game. heavy standard modules are imported where they're used.
+class LazyModule:
+    """ stands in for a module until one of its attributes is first used, then imports it
+    and replaces itself with the real module in this module's globals. """
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.name)
+        globals()[self.name] = module
+        return getattr(module, attribute)
+
+pygame = LazyModule("pygame")
+#endregion
 
 #region helper classes
 # not just for vectors, but for generic 2-tuples because why not?
 class Vec2d():
+    __slots__ = ("x", "y", "x_half", "y_half")
     def __init__(self, x, y):
         self.x = x
         self.y = y
         self.x_half = self.x / 2
         self.y_half = self.y / 2
-        self.value = f"{self.x}, {self.y}" # debug
+    @property
+    def value(self): # debug, only built when someone looks at it.
+        return f"{self.x}, {self.y}"
     def add(self, other):
         return Vec2d(self.x + other.x, self.y + other.y)
 
 # for the tiles that make up the map. still need to figure out what properties go where.
 class Tile:
+    __slots__ = ("image", "x", "y", "traversable", "world_coordinate")
     def __init__(self, img, x, y, traversable):
         self.image = img
         self.x = x
         self.y = y
         self.traversable = traversable # needed here? could do sth separate in generate_collsion_layer().
         self.world_coordinate = Vec2d(0, 0) # for identifying specific tiles, e.g. entrance/exit tiles.
+
+# roughly what one Tile and its world_coordinate take up, for TileMap.memory_size().
+TILE_BYTES = 256
+
+# bit flags kept per cell by the compact layers.
+TRAVERSABLE = 1
+
+# how each map_move direction moves the player, in world coordinates.
+# north/south/east/west step along one world axis and the screen-aligned ones diagonally.
+# up/down/left/right are the way the map scrolls, so the player goes the opposite way on screen.
+DIRECTIONS = {
+    "north" : (0, -1),
+    "south" : (0, 1),
+    "west"  : (-1, 0),
+    "east"  : (1, 0),
+    "up"    : (1, 1),
+    "down"  : (-1, -1),
+    "left"  : (1, -1),
+    "right" : (-1, 1),
+}
+
+# compact alternative to a list of lists of Tiles, for big maps.
+class TileLayer:
+    """ one map layer stored as typed arrays, one entry per world coordinate,
+    column by column (index x * height + y) like map_terrain_layer[x][y].
+    ids holds a tile type id per cell indexing into sprites, flags holds bit flags like TRAVERSABLE.
+    screen positions aren't stored at all, they come from to_isometric_grid when needed.
+
+    layer[x][y] returns a Tile built on demand and layer[x][y] = tile stores one,
+    so code written for the list of Tiles works on either storage. """
+    def __init__(self, tilemap, width, height, sprites, ids=None, flags=None):
+        self.tilemap = tilemap
+        self.width = width
+        self.height = height
+        # kept as given, not copied: a TileMap hands in a list it fills in once it loads its sprites.
+        self.sprites = sprites
+        self.sprite_ids = {sprite: i for i, sprite in enumerate(self.sprites) if sprite is not None}
+        # ids and flags can be handed in, e.g. as views of a memory-mapped level file.
+        self.ids = ids if ids is not None else array("H", bytes(2 * width * height))
+        self.flags = flags if flags is not None else bytearray(width * height)
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        return TileLayerColumn(self, x)
+
+    def sprite_id(self, sprite):
+        """ id of a sprite, adding it to the layer's sprites the first time it's seen. """
+        if sprite not in self.sprite_ids:
+            if sprite in self.sprites: # filled in after the layer was made.
+                self.sprite_ids[sprite] = self.sprites.index(sprite)
+            else:
+                self.sprite_ids[sprite] = len(self.sprites)
+                self.sprites.append(sprite)
+        return self.sprite_ids[sprite]
+
+    def sprite_at(self, x, y):
+        return self.sprites[self.ids[x * self.height + y]]
+
+    def set(self, x, y, tile_id, flags):
+        i = x * self.height + y
+        self.ids[i] = tile_id
+        self.flags[i] = flags
+
+    def tile_at(self, x, y):
+        i = x * self.height + y
+        position = self.tilemap.to_isometric_grid(Vec2d(x, y))
+        image = self.sprites[self.ids[i]]
+        if image is None: # sprites not loaded yet.
+            self.tilemap.load_sprites()
+            image = self.sprites[self.ids[i]]
+        tile = Tile(image, position.x, position.y, bool(self.flags[i] & TRAVERSABLE))
+        tile.world_coordinate = Vec2d(x, y)
+        return tile
+
+# what layer[x] returns, so that layer[x][y] reads and writes single cells.
+class TileLayerColumn:
+    __slots__ = ("layer", "x")
+    def __init__(self, layer, x):
+        self.layer = layer
+        self.x = x
+    def __len__(self):
+        return self.layer.height
+    def __getitem__(self, y):
+        return self.layer.tile_at(self.x, y)
+    def __setitem__(self, y, tile):
+        self.layer.set(self.x, y, self.layer.sprite_id(tile.image), TRAVERSABLE if tile.traversable else 0)
+
+# for things placed on the map that aren't terrain: monsters, the player, items on the ground.
+class Entity:
+    __slots__ = ("image", "world_coordinate", "solid")
+    def __init__(self, img, world_coordinate, solid=True):
+        self.image = img
+        self.world_coordinate = world_coordinate # can be fractional while moving between tiles.
+        self.solid = solid # whether it blocks the tile it's on.
+
+# indexes the object and entity layers by world coordinate.
+class SpatialHash:
+    """ uniform grid over world coordinates, each cell cell_size x cell_size tiles,
+    holding the things whose location falls in it. inserting, moving and removing
+    are O(1), and a query only looks at the cells it overlaps instead of every thing
+    on the map. things can be anything hashable, each kept at one location. """
+    def __init__(self, cell_size=8):
+        self.cell_size = cell_size
+        self.cells = {} # (cell x, cell y) -> {thing: None}, a dict as an ordered set.
+        self.locations = {} # thing -> (x, y)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __contains__(self, thing):
+        return thing in self.locations
+
+    def cell_of(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def insert(self, thing, location):
+        self.locations[thing] = (location.x, location.y)
+        self.cells.setdefault(self.cell_of(location.x, location.y), {})[thing] = None
+
+    def move(self, thing, location):
+        old = self.locations[thing]
+        self.locations[thing] = (location.x, location.y)
+        old_cell = self.cell_of(*old)
+        new_cell = self.cell_of(location.x, location.y)
+        if old_cell != new_cell:
+            self.discard_from_cell(thing, old_cell)
+            self.cells.setdefault(new_cell, {})[thing] = None
+
+    def remove(self, thing):
+        self.discard_from_cell(thing, self.cell_of(*self.locations.pop(thing)))
+
+    def discard_from_cell(self, thing, cell):
+        bucket = self.cells[cell]
+        del bucket[thing]
+        if not bucket:
+            del self.cells[cell]
+
+    def location_of(self, thing):
+        return Vec2d(*self.locations[thing])
+
+    def in_rect(self, left, top, right, bottom):
+        """ yields everything located within the world rect, edges included. """
+        cell_left, cell_top = self.cell_of(left, top)
+        cell_right, cell_bottom = self.cell_of(right, bottom)
+        if (cell_right - cell_left + 1) * (cell_bottom - cell_top + 1) > len(self.cells):
+            # a huge rect over a sparse layer, looking at each filled cell is quicker.
+            cells = [bucket for (cx, cy), bucket in self.cells.items()
+                     if cell_left <= cx <= cell_right and cell_top <= cy <= cell_bottom]
+        else:
+            cells = [self.cells[(cx, cy)]
+                     for cx in range(cell_left, cell_right + 1)
+                     for cy in range(cell_top, cell_bottom + 1) if (cx, cy) in self.cells]
+        for bucket in cells:
+            for thing in bucket:
+                x, y = self.locations[thing]
+                if left <= x <= right and top <= y <= bottom:
+                    yield thing
+
+    def in_radius(self, center, radius):
+        """ yields everything within radius tiles of center. """
+        radius_squared = radius * radius
+        for thing in self.in_rect(center.x - radius, center.y - radius, center.x + radius, center.y + radius):
+            x, y = self.locations[thing]
+            if (x - center.x) ** 2 + (y - center.y) ** 2 <= radius_squared:
+                yield thing
+
+    def at(self, location):
+        """ yields everything on the tile at a world coordinate. """
+        for thing in self.in_rect(location.x, location.y, location.x + 1, location.y + 1):
+            x, y = self.locations[thing]
+            if int(x) == location.x and int(y) == location.y:
+                yield thing
+
+# what can be walked on, one bit per tile.
+class CollisionLayer:
+    """ the collision layer as two bitsets with one bit per cell, bit i for index x * height + y.
+    static holds whether the terrain can be walked on.
+    walkable is static minus the cells a solid entity is standing on, kept up to date
+    one cell at a time as entities come and go, so it never needs rebuilding.
+    occupied counts the solid entities on each occupied cell. """
+    def __init__(self, width, height, static=None):
+        self.width = width
+        self.height = height
+        self.static = static if static is not None else bytearray((width * height + 7) // 8)
+        self.walkable = bytearray(self.static)
+        self.occupied = {} # index -> number of solid entities there.
+
+    @staticmethod
+    def pack(flags):
+        """ packs a bytes-like of one flags byte per cell into static bits.
+        the bits are spelled out as a string of 1s and 0s and read back as one big int,
+        which is done in C instead of looping over every cell. """
+        table = bytearray(b"0" * 256)
+        for flag in range(256):
+            if flag & TRAVERSABLE:
+                table[flag] = ord("1")
+        digits = bytes(flags).translate(table)[::-1]
+        return bytearray(int(digits or b"0", 2).to_bytes((len(flags) + 7) // 8, "little"))
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_static(self, x, y):
+        """ whether the terrain at x, y can be walked on, ignoring entities. """
+        if not self.in_bounds(x, y):
+            return False
+        i = x * self.height + y
+        return bool(self.static[i >> 3] >> (i & 7) & 1)
+
+    def is_walkable(self, x, y):
+        """ whether x, y is inside the map, traversable, and not taken by a solid entity. """
+        if not self.in_bounds(x, y):
+            return False
+        i = x * self.height + y
+        return bool(self.walkable[i >> 3] >> (i & 7) & 1)
+
+    def set_static(self, x, y, traversable):
+        i = x * self.height + y
+        if traversable:
+            self.static[i >> 3] |= 1 << (i & 7)
+            if i not in self.occupied:
+                self.walkable[i >> 3] |= 1 << (i & 7)
+        else:
+            self.static[i >> 3] &= ~(1 << (i & 7))
+            self.walkable[i >> 3] &= ~(1 << (i & 7))
+
+    def occupy(self, x, y):
+        """ a solid entity stepped onto x, y. """
+        if not self.in_bounds(x, y):
+            return
+        i = x * self.height + y
+        self.occupied[i] = self.occupied.get(i, 0) + 1
+        self.walkable[i >> 3] &= ~(1 << (i & 7))
+
+    def vacate(self, x, y):
+        """ a solid entity left x, y. the cell is walkable again once the last one is gone. """
+        if not self.in_bounds(x, y):
+            return
+        i = x * self.height + y
+        if self.occupied[i] > 1:
+            self.occupied[i] -= 1
+            return
+        del self.occupied[i]
+        if self.static[i >> 3] >> (i & 7) & 1:
+            self.walkable[i >> 3] |= 1 << (i & 7)
+
+    def bits_set(self, bits, start, end):
+        """ whether bits start to end - 1 are all set, checked as one int. """
+        count = end - start
+        if count <= 0:
+            return True
+        chunk = int.from_bytes(bits[start >> 3:(end + 7) >> 3], "little") >> (start & 7)
+        mask = (1 << count) - 1
+        return chunk & mask == mask
+
+    def rect_walkable(self, left, top, right, bottom):
+        """ whether every tile in the world rect, edges included, is walkable.
+        each column of the rect is a run of consecutive bits, so it's one check per column. """
+        if not (self.in_bounds(left, top) and self.in_bounds(right, bottom)):
+            return False
+        for x in range(left, right + 1):
+            start = x * self.height + top
+            if not self.bits_set(self.walkable, start, start + bottom - top + 1):
+                return False
+        return True
+
+    def line_walkable(self, start, goal):
+        """ whether every tile on the straight line between two world coordinates is walkable,
+        both ends included, stepping like a Bresenham line. """
+        x, y = start.x, start.y
+        dx, dy = abs(goal.x - x), -abs(goal.y - y)
+        step_x = 1 if goal.x > x else -1
+        step_y = 1 if goal.y > y else -1
+        error = dx + dy
+        while True:
+            if not self.is_walkable(x, y):
+                return False
+            if x == goal.x and y == goal.y:
+                return True
+            double_error = 2 * error
+            if double_error >= dy:
+                error += dy
+                x += step_x
+            if double_error <= dx:
+                error += dx
+                y += step_y
+
+    def static_digits(self):
+        """ the static bits spelled out as a string of "0"s and "1"s, character i for bit i. """
+        return format(int.from_bytes(self.static, "little"), "b").zfill(len(self.static) * 8)[::-1]
+
+    def padded(self):
+        """ the static bits as one byte per cell, 1 where it can be walked on, with a border
+        of cells that can't all the way around: index (x + 1) * (height + 2) + y + 1.
+        a step off any cell of the map lands in the border instead of off the end
+        or in the next column, so nothing needs bounds checks. """
+        digits = self.static_digits()
+        height = self.height
+        border = "0" * (height + 2)
+        columns = [border]
+        for x in range(self.width):
+            columns.append("0" + digits[x * height:(x + 1) * height] + "0")
+        columns.append(border)
+        return "".join(columns).encode().translate(DIGIT_VALUES)
+
+    def regions(self):
+        """ labels each cell that can be walked on with the region it's in, ignoring entities,
+        as an array indexed like the bits, with 0 for cells that can't be walked on.
+        diagonal moves can't cut corners, so two cells are connected exactly when they're
+        connected through their sides, and a path between cells in different regions can't exist.
+        worked out from the runs of walkable cells down each column, joining the runs
+        that touch in neighboring columns, so it's a step per run and not per cell. """
+        width, height = self.width, self.height
+        digits = self.static_digits()
+        runs = [] # (first, last + 1) index of each run.
+        parent = [] # union-find forest over the runs.
+
+        def find(run):
+            while parent[run] != run:
+                parent[run] = parent[parent[run]]
+                run = parent[run]
+            return run
+
+        previous = []
+        for x in range(width):
+            base = x * height
+            column = []
+            for match in WALKABLE_RUN.finditer(digits, base, base + height):
+                start, end = match.span()
+                column.append((start - base, end - base, len(runs)))
+                parent.append(len(runs))
+                runs.append((start, end))
+            # runs overlapping in y touch side to side.
+            i = j = 0
+            while i < len(previous) and j < len(column):
+                top, bottom, a = previous[i]
+                column_top, column_bottom, b = column[j]
+                if top < column_bottom and column_top < bottom:
+                    a, b = find(a), find(b)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+                if bottom < column_bottom:
+                    i += 1
+                else:
+                    j += 1
+            previous = column
+
+        labels = array("i", bytes(4 * width * height))
+        for run, (start, end) in enumerate(runs):
+            labels[start:end] = array("i", [find(run) + 1]) * (end - start)
+        return labels
+
+    def walkable_many(self, locations):
+        """ is_walkable for a batch of world coordinates, returned as a list of bools. """
+        walkable = self.walkable
+        width, height = self.width, self.height
+        results = []
+        for location in locations:
+            x, y = location.x, location.y
+            if 0 <= x < width and 0 <= y < height:
+                i = x * height + y
+                results.append(bool(walkable[i >> 3] >> (i & 7) & 1))
+            else:
+                results.append(False)
+        return results
+
+# which tiles can be seen from where the player is.
+class FieldOfView:
+    """ two bitsets like CollisionLayer's, bit i for index x * height + y.
+    visible holds the tiles in sight right now, explored every tile that has ever been.
+    lit lists the indices set in visible, so remaking it only clears those
+    and the cost stays down to the sight radius however big the map is. """
+    # how each of the 8 octants maps its (column, row) onto the map: xx, xy, yx, yy.
+    OCTANTS = (
+        (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+        (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.visible = bytearray((width * height + 7) // 8)
+        self.explored = bytearray((width * height + 7) // 8)
+        self.lit = []
+
+    def is_visible(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return False
+        i = x * self.height + y
+        return bool(self.visible[i >> 3] >> (i & 7) & 1)
+
+    def is_explored(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return False
+        i = x * self.height + y
+        return bool(self.explored[i >> 3] >> (i & 7) & 1)
+
+    def light(self, x, y):
+        i = x * self.height + y
+        if not self.visible[i >> 3] >> (i & 7) & 1:
+            self.visible[i >> 3] |= 1 << (i & 7)
+            self.explored[i >> 3] |= 1 << (i & 7)
+            self.lit.append(i)
+
+    def clear(self):
+        """ takes everything off visible, explored stays as it is. """
+        visible = self.visible
+        for i in self.lit:
+            visible[i >> 3] &= ~(1 << (i & 7))
+        self.lit = []
+
+    def compute(self, collision, origin, radius):
+        """ remakes visible for a viewer at origin who sees radius tiles far,
+        with recursive shadowcasting: each octant is scanned row by row outward,
+        and tiles that can't be walked on (walls) cast shadows that narrow the
+        slopes later rows are scanned over. walls are seen, what's behind them isn't. """
+        self.clear()
+        if not (0 <= origin.x < self.width and 0 <= origin.y < self.height):
+            return
+        self.light(origin.x, origin.y)
+        for xx, xy, yx, yy in self.OCTANTS:
+            self.cast_light(collision, origin.x, origin.y, 1, 1.0, 0.0, radius, xx, xy, yx, yy)
+
+    def cast_light(self, collision, cx, cy, row, start, end, radius, xx, xy, yx, yy):
+        """ scans one octant from row out to radius between slopes start and end,
+        recursing past each wall for the part of the rows it doesn't hide. """
+        if start < end:
+            return
+        width, height = self.width, self.height
+        static = collision.static
+        radius_squared = radius * radius
+        new_start = start
+        for distance in range(row, radius + 1):
+            dy = -distance
+            blocked = False
+            for dx in range(-distance, 1):
+                # slopes of the tile's left and right edges as seen from the origin.
+                left_slope = (dx - 0.5) / (dy + 0.5)
+                right_slope = (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+                x = cx + dx * xx + dy * xy
+                y = cy + dx * yx + dy * yy
+                inside = 0 <= x < width and 0 <= y < height
+                if inside and dx * dx + dy * dy <= radius_squared:
+                    self.light(x, y)
+                i = x * height + y
+                opaque = not inside or not static[i >> 3] >> (i & 7) & 1
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and distance < radius:
+                    blocked = True
+                    self.cast_light(collision, cx, cy, distance + 1, start, left_slope, radius, xx, xy, yx, yy)
+                    new_start = right_slope
+            if blocked:
+                break
+
+# a run of walkable cells in the static bits spelled out, see CollisionLayer.regions().
+WALKABLE_RUN = re.compile("1+")
+DIGIT_VALUES = bytes.maketrans(b"01", b"\x00\x01")
+
+# keeps pre-rendered chunks of the terrain layer around between frames.
+class ChunkCache:
+    """ least recently used cache of chunk surfaces, keyed by chunk coordinate.
+    budget is the most memory in bytes the cached surfaces are allowed to take up.
+    when a new chunk doesn't fit, the chunks that went the longest without being drawn
+    are thrown away first. chunks drawn in the current frame (see next_frame) are never
+    thrown away, so a budget too small for a frame goes over it instead of rendering
+    the same chunks again and again within the frame. """
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.surfaces = OrderedDict()
+        self.sizes = {}
+        self.frame = 0
+        self.drawn = {} # key -> frame it was last drawn in.
+
+    def next_frame(self):
+        self.frame += 1
+
+    def get(self, key):
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.surfaces.move_to_end(key)
+            self.drawn[key] = self.frame
+        return surf
+
+    def put(self, key, surf):
+        self.discard(key)
+        size = surf.get_bytesize() * surf.get_width() * surf.get_height()
+        self.surfaces[key] = surf
+        self.sizes[key] = size
+        self.drawn[key] = self.frame
+        self.used += size
+        while self.used > self.budget:
+            oldest = next(iter(self.surfaces))
+            # least recently drawn first, so everything from here on was drawn this frame.
+            if self.drawn[oldest] == self.frame:
+                break
+            self.discard(oldest)
+
+    def discard(self, key):
+        if key in self.surfaces:
+            del self.surfaces[key]
+            del self.drawn[key]
+            self.used -= self.sizes.pop(key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.sizes.clear()
+        self.drawn.clear()
+        self.used = 0
+
+# per-frame instrumentation, see TileMap.enable_stats().
+class FrameStats:
+    """ timings and counts for each frame of a TileMap.
+    phases holds the seconds spent in each phase of the frame in progress ("update", "draw",
+    or any name given to TileMap.phase()), counts how many of something happened in it:
+    "tiles", "chunks" and "things" blitted, "chunk_cache_hits"/"misses", "path_cache_hits"/"misses".
+    end_frame() files the frame away in history, which keeps the last few as dicts.
+    allocations are the net number of memory blocks Python allocated during the frame,
+    and gc_collections how many garbage collections ran. """
+    def __init__(self, history=120):
+        self.frame = 0
+        self.history = deque(maxlen=history)
+        self.profile_window = None # (first frame, last frame, start, stop), see TileMap.profile_frames().
+        self.font = None # for TileMap.draw_stats(), made the first time it's needed.
+        self.start_frame()
+
+    def start_frame(self):
+        self.phases = {}
+        self.counts = {}
+        self.frame_start = time.perf_counter()
+        self.blocks_start = sys.getallocatedblocks()
+        self.collections_start = sum(generation["collections"] for generation in gc.get_stats())
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def end_frame(self):
+        """ finishes the frame in progress and starts the next one. returns the finished frame. """
+        record = {
+            "frame": self.frame,
+            "seconds": time.perf_counter() - self.frame_start,
+            "phases": self.phases,
+            "counts": self.counts,
+            "allocations": sys.getallocatedblocks() - self.blocks_start,
+            "gc_collections": sum(generation["collections"] for generation in gc.get_stats()) - self.collections_start,
+        }
+        self.history.append(record)
+        self.frame += 1
+        self.start_frame()
+        return record
+
+    def averages(self):
+        """ the average of every timing and count over the frames in history,
+        as a dict shaped like one of them. """
+        frames = len(self.history) or 1
+        phases = {}
+        counts = {}
+        for record in self.history:
+            for name, seconds in record["phases"].items():
+                phases[name] = phases.get(name, 0) + seconds / frames
+            for name, n in record["counts"].items():
+                counts[name] = counts.get(name, 0) + n / frames
+        return {
+            "seconds": sum(record["seconds"] for record in self.history) / frames,
+            "phases": phases,
+            "counts": counts,
+            "allocations": sum(record["allocations"] for record in self.history) / frames,
+            "gc_collections": sum(record["gc_collections"] for record in self.history) / frames,
+        }
+
+    def hit_rate(self, cache):
+        """ the fraction of lookups in a cache ("chunk_cache" or "path_cache") that hit,
+        over the frames in history, or None if there weren't any. """
+        hits = sum(record["counts"].get(cache + "_hits", 0) for record in self.history)
+        misses = sum(record["counts"].get(cache + "_misses", 0) for record in self.history)
+        return hits / (hits + misses) if hits + misses else None
+
+    def summary(self):
+        """ lines of text describing the average frame, for an overlay or a log. """
+        average = self.averages()
+        lines = [f"Frame : {average['seconds'] * 1000:.2f} ms"]
+        for name, seconds in average["phases"].items():
+            lines.append(f"{name.capitalize()} : {seconds * 1000:.2f} ms")
+        counts = average["counts"]
+        lines.append(f"Blits : {counts.get('tiles', 0):.0f} tiles, {counts.get('chunks', 0):.0f} chunks, "
+                     f"{counts.get('things', 0):.0f} things")
+        for cache in ("chunk_cache", "path_cache"):
+            rate = self.hit_rate(cache)
+            if rate is not None:
+                lines.append(f"{cache.replace('_', ' ').capitalize()} hits : {rate:.0%}")
+        lines.append(f"Allocations : {average['allocations']:.0f}, GCs : {average['gc_collections']:.2f}")
+        return lines
+
+# what TileMap.phase() returns while stats are off.
+NO_PHASE = nullcontext()
+
+# what TileMap.phase() returns while stats are on.
+class PhaseTimer:
+    __slots__ = ("stats", "name", "start")
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+#endregion
+
+#region level file helpers
+# names of the terrain sprites in the order their tile type ids refer to them.
+TERRAIN_SPRITE_NAMES = ("default", "empty", "filled", "corners")
+
+# a text level is a matrix of characters, one row of the map per line.
+# rows are read as bytes so that one character is always one tile.
+def level_rows(path):
+    """ yields the rows of a text level one at a time, without their line endings. """
+    with open(path, "rb") as f:
+        for line in f:
+            yield line.rstrip(b"\r\n")
+
+def level_dimensions(path):
+    """ returns the (width, height) of a text level in tiles, the width being its longest row.
+    reads the file without keeping it around. """
+    width = 0
+    height = 0
+    for row in level_rows(path):
+        width = max(width, len(row))
+        height += 1
+    return width, height
+
+def level_row_tables(tile_kind):
+    """ bytes.translate() tables turning a row of a text level into a row of
+    terrain tile type ids and a row of terrain flags, using tile_kind(char). """
+    id_table = bytearray(256)
+    flag_table = bytearray(256)
+    for char in range(256):
+        name, traversable = tile_kind(chr(char))
+        id_table[char] = TERRAIN_SPRITE_NAMES.index(name)
+        flag_table[char] = TRAVERSABLE if traversable else 0
+    return bytes(id_table), bytes(flag_table)
+
+# a binary level is a header followed by each layer's cells column by column
+# (index x * height + y), little-endian, so it can be memory-mapped and used as is.
+# layer 0 is the terrain's tile type ids, id_width bytes each, layer 1 the terrain's flags.
+# header: magic, version, layer count, width, height, id width, player start x and y (-1 if none).
+LEVEL_MAGIC = b"TMAP"
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct("<4sHHIIH2xii4x")
+
+def is_binary_level(path):
+    with open(path, "rb") as f:
+        return f.read(len(LEVEL_MAGIC)) == LEVEL_MAGIC
+
+def read_level_header(data):
+    """ returns (width, height, layer count, id width, player start or None) of a binary level. """
+    magic, version, layer_count, width, height, id_width, player_x, player_y = LEVEL_HEADER.unpack_from(data)
+    if magic != LEVEL_MAGIC:
+        raise ValueError("not a binary level file")
+    if version != LEVEL_VERSION or layer_count < 2 or id_width not in (1, 2):
+        raise ValueError(f"unsupported binary level (version {version}, {layer_count} layers, {id_width} byte ids)")
+    player_start = Vec2d(player_x, player_y) if player_x >= 0 else None
+    return width, height, layer_count, id_width, player_start
+
+def convert_text_level(text_path, binary_path, tile_kind=None, progress=None):
+    """ converts a text level to a binary level.
+    like TileMap.load_text_level it streams the text one row at a time,
+    writing each row down its column of the memory-mapped output file.
+    tile_kind defaults to TileMap.tile_kind, progress gets (rows done, total rows). """
+    if tile_kind is None:
+        tile_kind = TileMap.tile_kind
+    width, height = level_dimensions(text_path)
+    id_table, flag_table = level_row_tables(tile_kind)
+    cells = width * height
+    ids_start = LEVEL_HEADER.size
+    flags_start = ids_start + cells
+    player_start = Vec2d(-1, -1)
+
+    with open(binary_path, "w+b") as f:
+        f.truncate(flags_start + cells)
+        if cells == 0:
+            f.write(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, 2, width, height, 1, -1, -1))
+            return
+        with mmap.mmap(f.fileno(), 0) as level:
+            for y, row in enumerate(level_rows(text_path)):
+                row = row.ljust(width)
+                level[ids_start + y : flags_start : height] = row.translate(id_table)
+                level[flags_start + y :: height] = row.translate(flag_table)
+                if b"P" in row:
+                    player_start = Vec2d(row.rindex(b"P"), y)
+                if progress:
+                    progress(y + 1, height)
+            LEVEL_HEADER.pack_into(level, 0, LEVEL_MAGIC, LEVEL_VERSION, 2,
+                width, height, 1, player_start.x, player_start.y)
+
+# entrances and exits are tiles leading to another level. they're listed in a text file
+# next to the level, with the same name and a .links extension (levels/lvl.links for
+# levels/lvl.txt or levels/lvl.tmap), one per line:
+#     entrance|exit x y level [arrival_x arrival_y]
+# level is relative to the links file. without an arrival tile the player arrives
+# wherever they are on the other level. everything after a # is a comment.
+class LevelLink:
+    __slots__ = ("kind", "location", "level", "arrival")
+    def __init__(self, kind, location, level, arrival=None):
+        self.kind = kind # "entrance" or "exit".
+        self.location = location # world coordinate of the tile on this level.
+        self.level = level # path of the level it leads to.
+        self.arrival = arrival # world coordinate the player arrives at there, or None.
+
+def level_links_path(path):
+    return os.path.splitext(path)[0] + ".links"
+
+def read_level_links(path):
+    """ the LevelLinks of a level from its .links file, none if it doesn't have one. """
+    links_path = level_links_path(path)
+    if not os.path.exists(links_path):
+        return []
+    links = []
+    with open(links_path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if fields[0] not in ("entrance", "exit") or len(fields) not in (4, 6):
+                raise ValueError(f"{links_path}:{number}: expected 'entrance|exit x y level [x y]'")
+            level = os.path.normpath(os.path.join(os.path.dirname(links_path), fields[3]))
+            arrival = Vec2d(int(fields[4]), int(fields[5])) if len(fields) == 6 else None
+            links.append(LevelLink(fields[0], Vec2d(int(fields[1]), int(fields[2])), level, arrival))
+    return links
+#endregion
+
+#region sprite atlas
+# sprites are found next to this file whatever the working directory and os are.
+RESOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "res")
+# and so are the levels.
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+TERRAIN_SPRITE_PATHS = {
+    "default" : os.path.join(RESOURCE_DIR, "isotile-outline.png"),
+    "empty"   : os.path.join(RESOURCE_DIR, "isotile-empty.png"),
+    "filled"  : os.path.join(RESOURCE_DIR, "isotile-filled.png"),
+    "corners" : os.path.join(RESOURCE_DIR, "isotile-colored-corners.png"),
+}
+
+# process-wide caches, so every TileMap and every level shares the same surfaces
+# and an image is read from disk once no matter how many maps use it.
+image_cache = {} # path -> Surface
+atlas_cache = {} # tuple of (name, path) -> SpriteAtlas
+
+class SpriteAtlas:
+    """ named sprites packed into a single surface, each one a subsurface of it.
+    sprites have an integer id in the order they were given, which is what
+    layers store instead of the surfaces themselves. sprites is indexed by id,
+    regions holds each sprite's rect on the atlas surface by name. """
+    def __init__(self, images, max_width=1024):
+        self.names = list(images)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.regions = {}
+        # shelf packing: tallest first, left to right, starting a new shelf when a row is full.
+        x = y = shelf_height = width = 0
+        for name in sorted(self.names, key=lambda name: -images[name].get_height()):
+            w, h = images[name].get_size()
+            if x and x + w > max_width:
+                x = 0
+                y += shelf_height
+                shelf_height = 0
+            self.regions[name] = pygame.Rect(x, y, w, h)
+            x += w
+            width = max(width, x)
+            shelf_height = max(shelf_height, h)
+        self.surface = pygame.Surface((max(width, 1), max(y + shelf_height, 1)), pygame.SRCALPHA)
+        for name, rect in self.regions.items():
+            # adding onto the cleared surface copies the pixels, alpha and all, without blending.
+            self.surface.blit(images[name], rect, special_flags=pygame.BLEND_RGBA_ADD)
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+        self.sprites = [self.surface.subsurface(self.regions[name]) for name in self.names]
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __getitem__(self, name):
+        return self.sprites[self.ids[name]]
+
+    def id_of(self, name):
+        return self.ids[name]
+
+def load_image(path):
+    """ loads an image once per process and returns the same surface after that. """
+    if path not in image_cache:
+        image = pygame.image.load(path)
+        image_cache[path] = image.convert_alpha() if pygame.display.get_surface() is not None else image
+    return image_cache[path]
+
+def load_atlas(paths):
+    """ returns the SpriteAtlas of a {name: path} dict of images, packing it the first time
+    those names and paths are asked for and sharing it after that. """
+    key = tuple(paths.items())
+    if key not in atlas_cache:
+        atlas_cache[key] = SpriteAtlas({name: load_image(path) for name, path in paths.items()})
+    return atlas_cache[key]
+#endregion
+
+#region picking helpers
+# the rectangle around a diamond tile also holds a corner of each of the 4 tiles next to it,
+# so a pixel in it belongs to one of 5 tiles. these are their world coordinate adjustments
+# from the tile the rectangle is around: itself, west, north, east and south.
+PICK_ADJUSTMENTS = ((0, 0), (-1, 0), (0, -1), (1, 0), (0, 1))
+
+pick_tables = {} # (tile width, tile height) -> pick table, shared by every map.
+mask_cache = weakref.WeakKeyDictionary() # Surface -> Mask, gone with the surface.
+
+def pick_adjustment(offsetx, offsety, half_h):
+    """ which tile a pixel offset into a cell's rectangle belongs to, out of PICK_ADJUSTMENTS.
+    uses linear equations to test which of the diamonds the pixel belongs to.
+    for a 64x32 tile the diamond's corners in cell coords are
+    top (32,0), right (64,16), bottom (32,32), left (0,16), and its edges have slopes:
+    - top-right and bottom-left edges: slope = -0.5 (y decreases by 16 per 32x)
+    - top-left and bottom-right edges: slope = 0.5 (y increases by 16 per 32x)
+    a point is inside the diamond if it's below both top edges and above both bottom ones. """
+    offsetx_half = 0.5 * offsetx # because it's a repeated calculation.
+    # top-left corner (above the top-left edge).
+    if offsety < half_h - offsetx_half:
+        return PICK_ADJUSTMENTS[1]  # belongs to west tile.
+    # top-right (above the top-right edge).
+    if offsety < offsetx_half - half_h:
+        return PICK_ADJUSTMENTS[2]  # belongs to north tile.
+    # bottom-right (below the bottom-right edge).
+    if offsety > 3 * half_h - offsetx_half:
+        return PICK_ADJUSTMENTS[3]  # belongs to east tile.
+    # bottom-left (below the bottom-left edge).
+    if offsety > offsetx_half + half_h:
+        return PICK_ADJUSTMENTS[4]  # belongs to south tile.
+    return PICK_ADJUSTMENTS[0] # inside the diamond, no adjustment needed.
+
+def pick_table(tile_size):
+    """ pick_adjustment of every whole pixel offset into a tile_size cell,
+    indexed by offsety * tile_size.x + offsetx. worked out once per tile size. """
+    key = (tile_size.x, tile_size.y)
+    table = pick_tables.get(key)
+    if table is None:
+        table = pick_tables[key] = [
+            pick_adjustment(offsetx, offsety, tile_size.y_half)
+            for offsety in range(int(tile_size.y)) for offsetx in range(int(tile_size.x))]
+    return table
+
+def sprite_mask(image):
+    """ the pygame.mask.Mask of an image's opaque pixels, made the first time it's asked for. """
+    mask = mask_cache.get(image)
+    if mask is None:
+        mask = mask_cache[image] = pygame.mask.from_surface(image)
+    return mask
+#endregion
+
+#region dungeon generation helpers
+# dungeons are generated in square chunks of DUNGEON_CHUNK_SIZE tiles, each one made by
+# generate_dungeon_chunk() from nothing but the seed and its own coordinates.
+# neighboring chunks agree on where the doors between them go, so chunks can be made
+# in any order, in threads or processes, and still join up into one connected dungeon.
+DUNGEON_CHUNK_SIZE = 32
+dungeon_executor = None
+
+def shared_dungeon_executor():
+    """ the thread pool dungeons are generated in when no executor is given,
+    made the first time it's needed and shared by every TileMap. """
+    global dungeon_executor
+    if dungeon_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        dungeon_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="dungeon")
+    return dungeon_executor
+
+def forget_dungeon_executor():
+    """ a forked process gets the parent's pool without its threads, so it makes its own. """
+    global dungeon_executor
+    dungeon_executor = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_dungeon_executor)
+
+def dungeon_door(seed, edge, length):
+    """ where along a chunk edge the door through it goes, the same for the chunks on both sides.
+    edge is ("v", cx, cy) for the left edge of chunk (cx, cy), ("h", cx, cy) for its top edge. """
+    if length <= 2:
+        return 0
+    return random.Random(f"{seed}:door:{edge[0]}:{edge[1]}:{edge[2]}").randint(1, length - 2)
+
+def dungeon_start(seed, width, height):
+    """ the (x, y) world coordinate the player starts on in a width x height dungeon,
+    picked from the seed alone so the same seed always makes the same dungeon. """
+    rng = random.Random(f"{seed}:start")
+    return (rng.randrange(width), rng.randrange(height))
+
+def generate_dungeon_chunk(seed, cx, cy, width, height, chunk_size=DUNGEON_CHUNK_SIZE, start=None):
+    """ generates chunk (cx, cy) of a width x height dungeon: a few rooms joined by corridors,
+    with a door on every side that has another chunk behind it.
+    start, a (x, y) world coordinate, gets a room around it if it's in this chunk.
+    returns (cx, cy, ids, flags), the terrain tile type ids and flags of the chunk's cells
+    as bytes, column by column like a TileLayer. chunks on the right and bottom edges
+    of the dungeon are cut short to fit. """
+    left = cx * chunk_size
+    top = cy * chunk_size
+    w = min(chunk_size, width - left)
+    h = min(chunk_size, height - top)
+    rng = random.Random(f"{seed}:{cx}:{cy}")
+    floor = [bytearray(h) for x in range(w)]
+
+    def carve(x0, y0, x1, y1):
+        y_start = max(min(y0, y1), 0)
+        y_end = min(max(y0, y1), h - 1) + 1
+        for x in range(max(min(x0, x1), 0), min(max(x0, x1), w - 1) + 1):
+            floor[x][y_start:y_end] = b"\x01" * (y_end - y_start)
+
+    rooms = []
+    if start is not None and left <= start[0] < left + w and top <= start[1] < top + h:
+        sx, sy = start[0] - left, start[1] - top
+        carve(sx - 1, sy - 1, sx + 1, sy + 1)
+        rooms.append((sx, sy))
+    for i in range(rng.randint(1, 3)):
+        room_w = rng.randint(min(3, w), min(10, w))
+        room_h = rng.randint(min(3, h), min(10, h))
+        x0 = rng.randint(0, w - room_w)
+        y0 = rng.randint(0, h - room_h)
+        carve(x0, y0, x0 + room_w - 1, y0 + room_h - 1)
+        rooms.append((x0 + room_w // 2, y0 + room_h // 2))
+
+    doors = []
+    if cx > 0:
+        doors.append((0, dungeon_door(seed, ("v", cx, cy), h)))
+    if left + w < width:
+        doors.append((w - 1, dungeon_door(seed, ("v", cx + 1, cy), h)))
+    if cy > 0:
+        doors.append((dungeon_door(seed, ("h", cx, cy), w), 0))
+    if top + h < height:
+        doors.append((dungeon_door(seed, ("h", cx, cy + 1), w), h - 1))
+
+    # L shaped corridors from the first room to everything else keep the chunk connected.
+    hub_x, hub_y = rooms[0]
+    for x, y in rooms[1:] + doors:
+        if rng.random() < 0.5:
+            carve(hub_x, hub_y, x, hub_y)
+            carve(x, hub_y, x, y)
+        else:
+            carve(hub_x, hub_y, hub_x, y)
+            carve(hub_x, y, x, y)
+
+    floor_id = TERRAIN_SPRITE_NAMES.index("default")
+    wall_id = TERRAIN_SPRITE_NAMES.index("empty")
+    cells = b"".join(floor)
+    ids = cells.translate(bytes([wall_id, floor_id]) + bytes(254))
+    flags = cells.translate(bytes([0, TRAVERSABLE]) + bytes(254))
+    return cx, cy, ids, flags
 #endregion
 
 #region TileMap class
@@ -45,32 +1051,57 @@ class TileMap:
     * tile class
     * world grid with size and origin
     * level loading function
-    * sprite atlas
+    * sprite atlas (SpriteAtlas, shared by every map through load_atlas)
     camera (fixed on player)
     * terrain layer
     object layer
     entity layer
     collision layer
     drawing of all layers done with double for loops
-    drawing each layer bottom to top for each individual tile position 
+    * drawing each layer bottom to top for each individual tile position 
     map boundaries
-    entrances and exits
+    * entrances and exits (LevelLinks, followed by LevelManager)
     * loading level data
-    level data generation for dungeons
+    * level data generation for dungeons
     * drawing function
     update function that updates each layer """
-    def __init__(self, drawing_surf, viewport_size, fixed, level="levels\\lvl.txt"):
+    def __init__(self, drawing_surf, viewport_size, fixed, level=os.path.join(LEVEL_DIR, "lvl.txt"),
+                 chunk_size=16, chunk_cache_budget=None, storage="tiles",
+                 load_progress=None, dirty_rects=False, scroll_buffer=False,
+                 seed=0, dungeon_size=Vec2d(128, 128), executor=None, sprites=None, stats=False,
+                 headless=False, fov_radius=None):
+        # headless maps keep only the logic and data layers: no display, no sprites,
+        # and drawing does nothing. drawing_surf can be None for them.
+        self.headless = headless
         self.drawing_surf = drawing_surf
         self.viewport_size = viewport_size
         self.map_data = level # data used to draw map loaded from external file.
+        # "tiles" keeps a Tile object per cell, "arrays" keeps the layers in TileLayers,
+        # which takes a few bytes per cell instead of a few hundred for big maps.
+        self.map_storage = storage
+        self.map_file = None # memory-mapped binary level backing the array storage, if any.
+        self.load_progress = load_progress # called with (rows loaded, total rows) while loading.
         self.map_is_fixed = fixed # does the map need to be loaded from a file as opposed to generated?
         self.map_loaded = False # did we already create this map?
-        self.terrain_sprites = {
-            "default" : pygame.image.load("res\\isotile-outline.png").convert_alpha(),
-            "empty"   : pygame.image.load("res\\isotile-empty.png").convert_alpha(),
-            "filled"  : pygame.image.load("res\\isotile-filled.png").convert_alpha(),
-            "corners" : pygame.image.load("res\\isotile-colored-corners.png").convert_alpha(),
-        }
+        # generated maps: the same seed and size always make the same dungeon.
+        # chunks are made by executor (a concurrent.futures executor, or a shared thread pool)
+        # and handed over a few at a time by update(), nearest to the player first.
+        self.map_seed = seed
+        self.dungeon_size = dungeon_size
+        self.dungeon_executor = executor
+        self.pending_chunks = [] # futures of dungeon chunks still being generated.
+        self.chunks_per_update = 4 # how many finished chunks update() hands over each frame.
+        # terrain sprites first, so their atlas ids are the tile type ids in TERRAIN_SPRITE_NAMES,
+        # then any object and entity sprites from sprites ({name: path}).
+        # the atlas is shared by every map using the same sprites, so loading a level loads no images.
+        # it's only loaded the first time something is drawn or sprite_atlas or terrain_sprites
+        # are used, see load_sprites(), and never when headless.
+        self.sprite_paths = {**TERRAIN_SPRITE_PATHS, **(sprites or {})}
+        self.loaded_atlas = None
+        self.loaded_terrain_sprites = None
+        # the sprites tile type ids index into, shared with the terrain TileLayer.
+        # all None until load_sprites() fills them in.
+        self.layer_sprites = [None] * len(TERRAIN_SPRITE_NAMES)
         """ map layers follow this order:
         terrain first because it's the first drawn, and could be traversable or not.
         object second because objects lay on the terrain.
@@ -86,17 +1117,90 @@ class TileMap:
         # where "cell" means the rectangle surrounding a tile - a tile's drawing rect.
         # origin's location based on the top left corner of a cell.
         self.map_offset = Vec2d(0, 0) # used for moving the camera.
-        #self.map_entrance = None
-        #self.map_exit = None
+        # entrances and exits: LevelLinks by world coordinate (x, y), from the level's .links file.
+        self.map_links = {}
         self.tile_size = Vec2d(64, 32)
-        #self.sprite_atlas = None
         #self.camera = None
+        # movement is simulated in fixed steps of sim_step seconds, however long frames take:
+        # update(elapsed) runs as many steps as fit in the time that went by,
+        # and map_offset is interpolated between them so the camera glides at any frame rate.
+        # a move between tiles takes move_steps steps, 4 steps at 25 per second by default.
+        self.sim_step = 1 / 25
+        self.move_steps = 4
+        self.sim_time = 0.0 # seconds simulated so far.
+        self.sim_accumulator = 0.0 # time that went by that isn't simulated yet, less than a step.
+        self.max_sim_steps = 8 # steps one update() may run before dropping time, None for no limit.
+        self.time_scale = 1.0 # > 1 runs the simulation faster than real time.
         self.moving = False
-        self.animation_frames_remaining = 0 # frames left in current movement animation.
+        self.animation_steps_done = 0 # steps taken in current movement animation.
+        self.animation_start_offset = Vec2d(0, 0) # map_offset when the animation started.
         self.animation_target_offset = Vec2d(0, 0) # total offset to move during this animation.
-        self.animation_increment = Vec2d(0, 0) # offset per frame.
+        # the terrain is drawn in square chunks of chunk_size x chunk_size tiles,
+        # each rendered once to its own surface. 0 or None draws tile by tile.
+        self.chunk_size = chunk_size
+        # the cache's budget in bytes. None sizes it from the viewport, see viewport_chunk_budget().
+        if chunk_cache_budget is None:
+            chunk_cache_budget = self.viewport_chunk_budget()
+        self.chunk_cache = ChunkCache(chunk_cache_budget)
+        # dirty rectangle mode: draw() only redraws the parts of the screen that changed
+        # and returns their rects for pygame.display.update(rects).
+        self.dirty_rect_mode = dirty_rects and not headless
+        self.background_color = (255, 255, 255) # what's behind the map in dirty rect mode.
+        self.dirty_all = True # the whole viewport needs drawing, e.g. the camera moved.
+        self.dirty_rects = [] # map regions to redraw on the next draw().
+        self.overlay_rects = [] # where draw_at_position drew this frame, to be erased next frame.
+        self.frame_rects = [] # what draw() returned this frame.
+        # scroll buffer: the map is drawn to an off-screen surface bigger than the viewport
+        # by scroll_margin on each side, and camera movement reuses what's already on it.
+        self.scroll_buffer = scroll_buffer and not headless
+        self.scroll_margin = Vec2d(2 * self.tile_size.x, 2 * self.tile_size.y)
+        self.scroll_surf = None
+        self.scroll_offset = Vec2d(0, 0) # map_offset the buffer was drawn at.
+        self.scroll_dirty = [] # buffer rects to redraw because their tiles changed.
+        # paths found by find_path(), most recently used last. emptied when collision changes.
+        self.path_cache = OrderedDict()
+        self.path_cache_size = 1024
+        # connected regions of the collision layer (see CollisionLayer.regions) and the
+        # padded grid search_path() walks (see CollisionLayer.padded), made when a path is
+        # first looked for and remade after collision changes. paths between regions are
+        # known not to exist without searching the whole region first.
+        self.path_regions = None
+        self.path_grid = None
+        # [generation, marks, g scores, came from], flat lists reused by every search_path().
+        self.path_search = None
+        # distance in moves from the player to every tile within flow_field_radius,
+        # for moving lots of monsters toward the player. made the first time it's used.
+        # only the searched square is kept, flow_field_origin is its top left world coordinate.
+        self.flow_field = None
+        self.flow_field_origin = (0, 0)
+        self.flow_field_source = None # flat index of the tile it was made from.
+        self.flow_field_stale = False # collision changed since it was made.
+        self.flow_field_radius = 64
+        # field of view: what the player can see within fov_radius tiles, walls blocking sight,
+        # and what they've seen before. a FieldOfView remade only when the player changes tiles.
+        # draw() blacks out tiles never seen and darkens the ones out of sight,
+        # and hides entities out of sight. None turns it off and everything is drawn.
+        self.fov_radius = fov_radius
+        self.fov = None
+        self.fov_source = None # flat index of the tile it was made from.
+        self.fov_stale = False # collision changed since it was made.
+        self.fog_colors = ((0, 0, 0, 255), (0, 0, 0, 144)) # never seen, seen before.
+        self.fog_sprites = None # fog_colors as tile-sized diamonds, made when first drawn.
+        # how many tiles above their own tile object and entity sprites can reach,
+        # so that tall ones standing just below the viewport still get drawn.
+        self.sprite_reach = 2
+        # objects sorted back to front, see static_draw_order(). None when it needs remaking.
+        self.static_order = None
+        # per-frame timings and counts, a FrameStats while turned on with enable_stats().
+        # None when off, which is all the instrumented code checks for.
+        self.stats = None
+        if stats:
+            self.enable_stats()
         if self.map_loaded == False:
             self.generate_terrain_layer() # needed here?
+            self.generate_object_layer()
+            self.generate_entity_layer()
+            self.generate_collision_layer()
         
         # initialize player location after terrain is generated.
         # use viewport center directly, not map_center_tile() which returns a drawing position
@@ -118,67 +1222,42 @@ class TileMap:
     def pixelxy_to_world_coord(self, position):
         """ takes a set of screen coordinates and returns the world coordinate of the tile there.
         pixel coord -> world coord
-        determine which diamond tile contains the pixel:
+        see pick_cell() for how the tile is found. """
+
+        # adjust position to account for map offset (camera movement).
+        return self.pick_cell(position.x - self.map_offset.x, position.y - self.map_offset.y)
+
+    def pick_cell(self, x, y):
+        """ the world coordinate of the diamond tile containing pixel (x, y) of the map grid:
         1. determine which rectangular cell the pixel is in.
         2. get the offset within that cell.
-        3. use linear equations to test which 4 diamonds the pixel belongs to.
-        
-        ex: for a 64x32 isometric tile, the diamond edges have slopes:
-        - top-right and bottom-left edges: slope = -0.5 (y decreases by 16 per 32x)
-        - top-left and bottom-right edges: slope = 0.5 (y increases by 16 per 32x) """
+        3. look up which of the 5 diamonds in the rectangle the offset belongs to.
+        whole pixel offsets are looked up in pick_table(), so there's no edge testing per call.
+        fractional ones (e.g. while the map_offset is mid-scroll) go through pick_adjustment(). """
+        width = self.tile_size.x
+        fractional = x % 1 or y % 1
+        if not fractional: # whole floats, e.g. from map_offset after map_move, work like ints.
+            x = int(x)
+            y = int(y)
+        # base cell and offset into cell (0 to tile_size-1).
+        cellx, offsetx = divmod(x, width)
+        celly, offsety = divmod(y, self.tile_size.y)
+        cellx -= self.map_origin.x
+        celly -= self.map_origin.y
 
-        # adjust position to account for map offset (camera movement).
-        adjusted_x = position.x - self.map_offset.x
-        adjusted_y = position.y - self.map_offset.y
-
-        # offset into cell (0 to tile_size-1).
-        offsetx = adjusted_x % self.tile_size.x
-        offsety = adjusted_y % self.tile_size.y
-        offsetx_half = 0.5 * offsetx # because it's a repeated calculation.
-
-        # base cell calculation.
-        selected = Vec2d(
-            int(((adjusted_y // self.tile_size.y) - self.map_origin.y) + ((adjusted_x // self.tile_size.x) - self.map_origin.x)),
-            int(((adjusted_y // self.tile_size.y) - self.map_origin.y) - ((adjusted_x // self.tile_size.x) - self.map_origin.x)))
-        
-        # mathematical tile selection:
-        # check if the pixel is inside the diamond or in one of the 4 corner regions.
-        # diamond corners in cell coords: 
-        # top (32,0), right (64,16), bottom (32,32), left (0,16)
-        
-        half_w = self.tile_size.x_half  # 32
-        half_h = self.tile_size.y_half  # 16
-        
-        # diamond edge equations in cell coordinates (offsetx, offsety):
-        # a point is inside the diamond if it satisfies all four inequalities:
-        # - above top-left edge:     offsety > half_h - offsetx_half
-        # - above top-right edge:    offsety > offsetx_half - half_h
-        # - below bottom-right edge: offsety < 3 * half_h - offsetx_half
-        # - below bottom-left edge:  offsety < offsetx_half + half_h
-        
-        # check each edge to see if we're in a corner region:
-        
-        # top-left corner (above the top-left edge).
-        if offsety < half_h - offsetx_half:
-            selected.x -= 1  # belongs to west tile.
-        # top-right (above the top-right edge).
-        elif offsety < offsetx_half - half_h:
-            selected.y -= 1  # belongs to north tile.
-        # bottom-right (below the bottom-right edge).
-        elif offsety > 3 * half_h - offsetx_half:
-            selected.x += 1  # belongs to east tile.
-        # bottom-left (below the bottom-left edge).
-        elif offsety > offsetx_half + half_h:
-            selected.y += 1  # belongs to south tile.
-        # else: inside the diamond, no adjustment needed.
-        
-        return selected
+        if fractional: # only whole offsets are in the table.
+            dx, dy = pick_adjustment(offsetx, offsety, self.tile_size.y_half)
+        else:
+            dx, dy = pick_table(self.tile_size)[offsety * width + offsetx]
+        return Vec2d(int(celly + cellx) + dx, int(celly - cellx) + dy)
     
     def world_coord_to_pixelxy(self, world_coord):
         """ converts world coord to on-screen pixel coord for drawing.
         used for when something happens around the player and we need to 
         know which tile relative to the player we're working with.
         world coord -> pixel coord """
+        if self.map_storage == "arrays":
+            return self.to_isometric_grid(world_coord)
         tile = self.map_terrain_layer[world_coord.x][world_coord.y]
         return Vec2d(tile.x, tile.y)
 
@@ -187,32 +1266,8 @@ class TileMap:
         after the map grid is converted to isometric coords.
         the "on-screen coords" are the top-left corner of the tile's rectangle.
         pixel coord -> pixel coord 
-        uses the same mathematical approach as pixelxy_to_world_coord. """
-        
-        offsetx = position.x % self.tile_size.x
-        offsety = position.y % self.tile_size.y
-
-        offsetx_half = 0.5 * offsetx
-
-        selected = Vec2d(
-            ((position.y // self.tile_size.y) - self.map_origin.y) + ((position.x // self.tile_size.x) - self.map_origin.x),
-            ((position.y // self.tile_size.y) - self.map_origin.y) - ((position.x // self.tile_size.x) - self.map_origin.x))
-
-        # same tile selection as pixelxy_to_world_coord
-        half_w = self.tile_size.x_half
-        half_h = self.tile_size.y_half
-        
-        # check if pixel is in a corner region outside the diamond
-        if offsety < half_h - offsetx_half:
-            selected.x -= 1
-        elif offsety < offsetx_half - half_h:
-            selected.y -= 1
-        elif offsety > 3 * half_h - offsetx_half:
-            selected.x += 1
-        elif offsety > offsetx_half + half_h:
-            selected.y += 1
-
-        return self.to_isometric_grid(selected)
+        picks the tile the same way as pixelxy_to_world_coord, without the map offset. """
+        return self.to_isometric_grid(self.pick_cell(position.x, position.y))
 
     def map_center_tile(self):
         """ for locating player's position.
@@ -240,8 +1295,8 @@ class TileMap:
         return self.map_terrain_layer[world_coord.x][world_coord.y]
 
     def map_move(self, direction):
-        """ initiates an animated movement between tiles happening over 4 frames, 
-        with 1/4 tile movement per frame. movement only starts if not already animating. """
+        """ initiates an animated movement between tiles taking move_steps simulation steps,
+        see update(). movement only starts if not already animating. """
         
         # ignore input if already animating.
         if self.moving:
@@ -279,22 +1334,27 @@ class TileMap:
             target.x = half_tile_w * 2
             target.y = 0
 
-        """ stop movement if it would go out of bounds (not implemented yet).
-        player_position = self.world_coord_to_pixelxy(self.map_player_location)
-        if not self.inside_world_bounds(player_position.add(target)):
-            target.x = 0
-            target.y = 0 """
+        # stop movement if it would go out of bounds or into something solid.
+        if direction in DIRECTIONS and not self.can_move(self.map_player_location, direction):
+            return
 
         # set up animation parameters.
         self.moving = True
-        self.animation_frames_remaining = 4
+        self.animation_steps_done = 0
+        self.animation_start_offset = Vec2d(self.map_offset.x, self.map_offset.y)
         self.animation_target_offset = target
-        self.animation_increment = Vec2d(target.x / 4, target.y / 4)
 
     def draw_at_position(self, tile_image, position):
-        """ draws a specific tile at a specific position on the screen. """
-        self.drawing_surf.blit(tile_image, 
+        """ draws a specific tile at a specific position on the screen.
+        in dirty rect mode it's drawn over the map for this frame only, so its rect
+        is added to this frame's rects and redrawn with the map next frame. """
+        if self.headless:
+            return
+        rect = self.drawing_surf.blit(tile_image, 
             (position.x, position.y, self.tile_size.x, self.tile_size.y))
+        if self.dirty_rect_mode:
+            self.frame_rects.append(rect)
+            self.overlay_rects.append(rect)
 
     def draw_at_location(self, tile_image, location):
         """ draws a specific tile at a specific world coordinate.
@@ -304,126 +1364,1719 @@ class TileMap:
         tile.world_coordinate.x = location.x
         tile.world_coordinate.y = location.y
         self.map_terrain_layer[location.x][location.y] = tile
-        self.drawing_surf.blit(tile.image, (
+        self.invalidate_tile(location)
+        self.set_traversable(location, tile.traversable)
+        if self.headless:
+            return
+        rect = self.drawing_surf.blit(tile.image, (
             tile.x + self.map_offset.x, 
             tile.y + self.map_offset.y, 
             self.tile_size.x, self.tile_size.y))
+        if self.dirty_rect_mode:
+            self.mark_dirty(rect)
+        if self.scroll_surf is not None:
+            self.scroll_dirty.append(pygame.Rect(
+                tile.x + self.scroll_offset.x + self.scroll_margin.x,
+                tile.y + self.scroll_offset.y + self.scroll_margin.y,
+                self.tile_size.x, self.tile_size.y))
+
+    def visible_cells(self, area=None, scale=1, offset=None):
+        """ yields the world coordinates of the tiles whose drawing rect overlaps
+        area (x, y, w, h) on the screen, which defaults to the whole viewport.
+        offset is the map offset to draw at, map_offset by default.
+        tiles come out in back to front order, one x+y diagonal at a time.
+        scale groups scale x scale tiles into one cell, so the same math works for chunks.
+
+        this is the inverse of to_isometric_grid. a cell is drawn at
+        origin + (x - y) * half width, origin + (x + y) * half height,
+        so the visible range of u = x - y and v = x + y can be solved for directly
+        instead of looping over the whole map and throwing most of it away. """
+        u_min, u_max, v_min, v_max = self.visible_range(area, scale, offset)
+        columns = -(-self.map_size.x // scale)
+        rows = -(-self.map_size.y // scale)
+
+        for v in range(max(v_min, 0), min(v_max, columns + rows - 2) + 1):
+            # x = (u + v) / 2 and y = v - x, kept inside the map.
+            x_start = max(0, v - rows + 1, -(-(u_min + v) // 2))
+            x_end = min(columns - 1, v, (u_max + v) // 2)
+            for x in range(x_start, x_end + 1):
+                yield x, v - x
+
+    def visible_range(self, area=None, scale=1, offset=None):
+        """ the range of diagonals u = x - y and v = x + y of the cells that can overlap area,
+        as (u_min, u_max, v_min, v_max). see visible_cells(). """
+        if area is None:
+            area = (0, 0, self.viewport_size.x, self.viewport_size.y)
+        if offset is None:
+            offset = self.map_offset
+        area_x, area_y, area_w, area_h = area
+
+        # size and step of a cell in pixels.
+        cell_w = self.tile_size.x * scale
+        cell_h = self.tile_size.y * scale
+        step_w = self.tile_size.x_half * scale
+        step_h = self.tile_size.y_half * scale
+
+        # drawing position of cell (0, 0). a cell of several tiles has its rect
+        # pushed left by the extra tiles hanging off its left corner.
+        base_x = self.map_origin.x * self.tile_size.x + offset.x - (scale - 1) * self.tile_size.x_half
+        base_y = self.map_origin.y * self.tile_size.y + offset.y
+
+        # solve base + u * step < area end and base + u * step + cell > area start for u and v.
+        # floor/ceil keeps a one cell margin for the int() rounding in to_isometric_grid.
+        u_min = math.floor((area_x - base_x - cell_w) / step_w)
+        u_max = math.ceil((area_x + area_w - base_x) / step_w)
+        v_min = math.floor((area_y - base_y - cell_h) / step_h)
+        v_max = math.ceil((area_y + area_h - base_y) / step_h)
+        return u_min, u_max, v_min, v_max
+
+    def visible_world_rect(self, area=None, reach=0):
+        """ the world rect (left, top, right, bottom) around every tile that can overlap area.
+        reach adds tiles below it whose sprites are up to that many tiles tall. """
+        u_min, u_max, v_min, v_max = self.visible_range(area)
+        v_max += 2 * reach
+        return (
+            (u_min + v_min) // 2, (v_min - u_max) // 2,
+            -(-(u_max + v_max) // 2), -(-(v_max - u_min) // 2))
 
     def draw(self, offset = Vec2d(0, 0)):
-        """ draws the entire level based on player position.
-        offset parameter adjusts to where that is. """
-        if offset.x != 0 and offset.y != 0:
-            self.map_offset.x = offset.x
-            self.map_offset.y = offset.y
-        for y in range(self.map_size.y):
+        """ draws the part of the level that is inside the viewport based on player position.
+        offset parameter adjusts to where that is.
+        only tiles returned by visible_cells() are blitted, so the cost of a frame
+        depends on the size of the viewport and not the size of the map.
+        in dirty rect mode, returns the rects that changed (see draw_dirty).
+        headless maps don't draw anything. """
+        if self.headless:
+            return [] if self.dirty_rect_mode else None
+        with self.phase("draw"):
+            self.chunk_cache.next_frame()
+            if offset.x != 0 and offset.y != 0:
+                self.map_offset.x = offset.x
+                self.map_offset.y = offset.y
+                self.dirty_all = True
+            if self.dirty_rect_mode:
+                return self.draw_dirty()
+            self.draw_area()
+
+    def draw_area(self, area=None):
+        """ draws the map inside area (x, y, w, h) of the viewport, all of it by default,
+        with one batched blit of render_queue(). the terrain comes from the scroll buffer
+        instead when that's turned on. """
+        if self.scroll_buffer:
+            self.draw_scrolled(area)
+            self.blit_batch(self.drawing_surf, self.fog_queue(area) + self.things_queue(area))
+        else:
+            self.blit_batch(self.drawing_surf, self.render_queue(area))
+
+    @staticmethod
+    def blit_batch(surf, batch):
+        """ blits a list of (image, position) in one call instead of one call per sprite.
+        fblits (pygame-ce) skips making the list of rects that blits returns. """
+        if hasattr(surf, "fblits"):
+            surf.fblits(batch)
+        else:
+            surf.blits(batch, False)
+
+    def render_queue(self, area=None, offset=None):
+        """ everything to draw inside area as (image, position), in drawing order:
+        the terrain as the ground under everything, the fog of war over it (see fog_queue),
+        then the objects and entities standing on it back to front (see things_in_view). """
+        return self.terrain_queue(area, offset) + self.fog_queue(area, offset) + self.things_queue(area)
+
+    def things_queue(self, area=None):
+        queue = [(thing.image, (rect.x, rect.y)) for thing, rect in self.things_in_view(area)]
+        if self.stats is not None:
+            self.stats.count("things", len(queue))
+        return queue
+
+    def entity_rect(self, thing, offset=None):
+        """ screen rect of an object or entity's sprite. sprites stand on their tile:
+        centered on it horizontally with their bottom on the bottom of its rect. """
+        if offset is None:
+            offset = self.map_offset
+        position = self.to_isometric_grid(thing.world_coordinate)
+        width, height = thing.image.get_size()
+        return pygame.Rect(
+            position.x + offset.x + (self.tile_size.x - width) // 2,
+            position.y + offset.y + self.tile_size.y - height,
+            width, height)
+
+    def static_draw_order(self):
+        """ the objects sorted by x + y, made once and kept until the object layer changes.
+        returns (objects, depths) with depths[i] the x + y of objects[i], for bisecting. """
+        if self.static_order is None:
+            objects = sorted(self.map_object_layer,
+                key=lambda thing: thing.world_coordinate.x + thing.world_coordinate.y)
+            self.static_order = objects, [
+                thing.world_coordinate.x + thing.world_coordinate.y for thing in objects]
+        return self.static_order
+
+    def things_in_view(self, area=None):
+        """ the objects and entities whose sprites overlap area, the viewport by default,
+        each with its screen rect, back to front in isometric depth order:
+        by x + y, and objects before entities on the same diagonal.
+        objects don't move, so they come presorted from static_draw_order() and only the
+        diagonals in view are looked at. the few entities in view are sorted on their own
+        and merged in, so nothing gets sorted as a whole every frame.
+        with the field of view on, only what in_sight() lets through is in there. """
+        if area is None:
+            area = (0, 0, self.viewport_size.x, self.viewport_size.y)
+        area = pygame.Rect(area)
+        u_min, u_max, v_min, v_max = self.visible_range(area)
+        v_max += 2 * self.sprite_reach
+
+        objects, depths = self.static_draw_order()
+        static = []
+        for i in range(bisect.bisect_left(depths, v_min), bisect.bisect_right(depths, v_max)):
+            thing = objects[i]
+            if u_min <= thing.world_coordinate.x - thing.world_coordinate.y <= u_max:
+                rect = self.entity_rect(thing)
+                if rect.colliderect(area) and self.in_sight(thing, True):
+                    static.append((depths[i], 0, i, thing, rect))
+
+        left, top, right, bottom = self.visible_world_rect(area, self.sprite_reach)
+        dynamic = []
+        for i, thing in enumerate(self.map_entity_layer.in_rect(left, top, right, bottom)):
+            rect = self.entity_rect(thing)
+            if rect.colliderect(area) and self.in_sight(thing):
+                dynamic.append((thing.world_coordinate.x + thing.world_coordinate.y, 1, i, thing, rect))
+        dynamic.sort()
+        return [(thing, rect) for depth, layer, i, thing, rect in heapq.merge(static, dynamic)]
+
+    def draw_things(self, area=None):
+        """ draws the object and entity layers over the terrain inside area. """
+        self.blit_batch(self.drawing_surf, self.things_queue(area))
+
+    def terrain_queue(self, area=None, offset=None):
+        """ the terrain overlapping area (x, y, w, h) as (image, position), back to front.
+        that's the cached chunk surfaces when chunking is on, rendering missing ones,
+        or else every tile. offset defaults to map_offset. """
+        if offset is None:
+            offset = self.map_offset
+        if self.loaded_atlas is None:
+            self.load_sprites()
+        stats = self.stats
+        if self.chunk_size:
+            queue = []
+            for cx, cy in self.visible_cells(area, self.chunk_size, offset):
+                chunk = self.chunk_cache.get((cx, cy))
+                if chunk is None:
+                    chunk = self.render_chunk(cx, cy)
+                    self.chunk_cache.put((cx, cy), chunk)
+                    if stats is not None:
+                        stats.count("chunk_cache_misses")
+                elif stats is not None:
+                    stats.count("chunk_cache_hits")
+                anchor = self.chunk_anchor(cx, cy)
+                queue.append((chunk, (anchor.x + offset.x, anchor.y + offset.y)))
+            if stats is not None:
+                stats.count("chunks", len(queue))
+            return queue
+        queue = []
+        for x, y in self.visible_cells(area, 1, offset):
+            image, tile_x, tile_y = self.terrain_at(x, y)
+            queue.append((image, (tile_x + offset.x, tile_y + offset.y)))
+        if stats is not None:
+            stats.count("tiles", len(queue))
+        return queue
+
+    def draw_terrain(self, area=None, surf=None, offset=None):
+        """ draws the terrain overlapping area (x, y, w, h), the whole viewport by default.
+        surf and offset default to drawing_surf and map_offset. """
+        if surf is None:
+            surf = self.drawing_surf
+        self.blit_batch(surf, self.terrain_queue(area, offset))
+
+    def fog_queue(self, area=None, offset=None):
+        """ the fog of war over the terrain overlapping area as (image, position), back to front:
+        a solid diamond over each tile the player has never seen, and a see-through one
+        over each tile they've seen before but can't see now. empty with the field of view off.
+        it's drawn over the terrain instead of into it, so cached chunks and the scroll buffer
+        stay the same however the view changes. """
+        if self.fov_radius is None:
+            return []
+        if offset is None:
+            offset = self.map_offset
+        self.update_fov()
+        if self.fog_sprites is None:
+            # shaped like the filled tile, so the fog lines up with the terrain exactly.
+            shape = sprite_mask(self.terrain_sprites["filled"])
+            self.fog_sprites = [
+                shape.to_surface(setcolor=color, unsetcolor=(0, 0, 0, 0)) for color in self.fog_colors]
+        unexplored, remembered = self.fog_sprites
+        height = self.fov.height
+        visible = self.fov.visible
+        explored = self.fov.explored
+        queue = []
+        for x, y in self.visible_cells(area, 1, offset):
+            i = x * height + y
+            if visible[i >> 3] >> (i & 7) & 1:
+                continue
+            position = self.to_isometric_grid(Vec2d(x, y))
+            image = remembered if explored[i >> 3] >> (i & 7) & 1 else unexplored
+            queue.append((image, (position.x + offset.x, position.y + offset.y)))
+        if self.stats is not None:
+            self.stats.count("fog", len(queue))
+        return queue
+
+    def mark_dirty(self, rect):
+        """ marks a screen rect as needing a redraw on the next draw() in dirty rect mode. """
+        self.dirty_rects.append(pygame.Rect(rect))
+
+    def draw_dirty(self):
+        """ dirty rect mode's draw(). redraws only what changed since the last frame:
+        rects marked with mark_dirty(), last frame's draw_at_position() overlays,
+        or the whole viewport once the camera moved.
+        each rect is cleared to background_color and the map is drawn into it clipped.
+
+        returns the list of rects to pass to pygame.display.update(). the same list
+        keeps collecting draw_at_position() calls made after draw() this frame,
+        so pass it to pygame.display.update() at the end of the frame. an idle frame
+        returns an empty list and costs nearly nothing. """
+        # before picking the rects, so fog that moved since the last frame redraws this frame.
+        self.update_fov()
+        viewport = pygame.Rect(0, 0, self.viewport_size.x, self.viewport_size.y)
+        rects = self.dirty_rects + self.overlay_rects
+        if self.dirty_all:
+            rects = [viewport] + [rect for rect in rects if not viewport.contains(rect)]
+        self.dirty_all = False
+        self.dirty_rects = []
+        self.overlay_rects = []
+
+        old_clip = self.drawing_surf.get_clip()
+        for rect in rects:
+            self.drawing_surf.set_clip(rect)
+            self.drawing_surf.fill(self.background_color, rect)
+            area = rect.clip(viewport)
+            if area.width and area.height:
+                self.draw_area(area)
+        self.drawing_surf.set_clip(old_clip)
+
+        self.frame_rects = rects
+        return self.frame_rects
+
+    def draw_scrolled(self, area=None):
+        """ scroll buffer mode's drawing. the buffer holds the map drawn at scroll_offset,
+        with scroll_margin pixels to spare on every side of the viewport.
+        while the camera stays within the margin, drawing is a single blit of the right part
+        of the buffer. once it moves past the margin, the buffer's contents are shifted with
+        Surface.scroll() to recenter it, and only the strips that scrolled in are drawn,
+        so moving costs the tiles along the edge instead of every tile on screen. """
+        if area is None:
+            area = (0, 0, self.viewport_size.x, self.viewport_size.y)
+        area = pygame.Rect(area)
+        offset = Vec2d(int(round(self.map_offset.x)), int(round(self.map_offset.y)))
+        margin = self.scroll_margin
+        size = (int(self.viewport_size.x + 2 * margin.x), int(self.viewport_size.y + 2 * margin.y))
+
+        if self.scroll_surf is None or self.scroll_surf.get_size() != size:
+            self.scroll_surf = pygame.Surface(size)
+            self.scroll_offset = offset
+            self.scroll_dirty = [self.scroll_surf.get_rect()]
+        else:
+            dx = offset.x - self.scroll_offset.x
+            dy = offset.y - self.scroll_offset.y
+            if abs(dx) > margin.x or abs(dy) > margin.y:
+                self.scroll_recenter(dx, dy)
+
+        for rect in self.scroll_dirty:
+            self.draw_scroll_area(rect)
+        self.scroll_dirty = []
+
+        self.drawing_surf.blit(self.scroll_surf, area, (
+            area.x + margin.x - (offset.x - self.scroll_offset.x),
+            area.y + margin.y - (offset.y - self.scroll_offset.y),
+            area.width, area.height))
+
+    def scroll_recenter(self, dx, dy):
+        """ moves the scroll buffer's contents by dx, dy so the camera is back at its center,
+        and marks the strips along the edges that scrolled in for drawing. """
+        width, height = self.scroll_surf.get_size()
+        self.scroll_offset = Vec2d(self.scroll_offset.x + dx, self.scroll_offset.y + dy)
+        if abs(dx) >= width or abs(dy) >= height:
+            self.scroll_dirty = [self.scroll_surf.get_rect()]
+            return
+        self.scroll_surf.scroll(dx, dy)
+        # rects still waiting to be redrawn moved along with everything else.
+        self.scroll_dirty = [rect.move(dx, dy) for rect in self.scroll_dirty]
+        if dx > 0:
+            self.scroll_dirty.append(pygame.Rect(0, 0, dx, height))
+        elif dx < 0:
+            self.scroll_dirty.append(pygame.Rect(width + dx, 0, -dx, height))
+        if dy > 0:
+            self.scroll_dirty.append(pygame.Rect(0, 0, width, dy))
+        elif dy < 0:
+            self.scroll_dirty.append(pygame.Rect(0, height + dy, width, -dy))
+
+    def draw_scroll_area(self, rect):
+        """ redraws one rect of the scroll buffer from the map. """
+        self.scroll_surf.set_clip(rect)
+        self.scroll_surf.fill(self.background_color, rect)
+        self.draw_terrain(rect, self.scroll_surf, Vec2d(
+            self.scroll_offset.x + self.scroll_margin.x,
+            self.scroll_offset.y + self.scroll_margin.y))
+        self.scroll_surf.set_clip(None)
+
+    def terrain_at(self, x, y):
+        """ returns the terrain image and drawing position of a tile for either storage,
+        without building a Tile for the array storage. """
+        if self.map_storage == "arrays":
+            position = self.to_isometric_grid(Vec2d(x, y))
+            return self.map_terrain_layer.sprite_at(x, y), position.x, position.y
+        tile = self.map_terrain_layer[x][y]
+        return tile.image, tile.x, tile.y
+
+    #endregion
+
+    #region chunk functions
+    def chunk_of(self, location):
+        """ returns the chunk coordinate holding a world coordinate. """
+        return (location.x // self.chunk_size, location.y // self.chunk_size)
+
+    def chunk_anchor(self, cx, cy):
+        """ position of the top left corner of a chunk's surface, without the map offset.
+        a chunk is a big diamond, so its rect starts chunk_size - 1 half tiles
+        to the left of the first tile in it. """
+        return Vec2d(
+            int(self.map_origin.x * self.tile_size.x
+                + (cx - cy) * self.chunk_size * self.tile_size.x_half
+                - (self.chunk_size - 1) * self.tile_size.x_half),
+            int(self.map_origin.y * self.tile_size.y
+                + (cx + cy) * self.chunk_size * self.tile_size.y_half))
+
+    def viewport_chunk_budget(self):
+        """ bytes taken by the chunk surfaces that can overlap the viewport at once,
+        plus a ring of chunks around them, so scrolling back and forth finds them still cached.
+        at least 32 MB, so small viewports still keep some chunks around. """
+        if not self.chunk_size:
+            return 32 * 1024 * 1024
+        u_min, u_max, v_min, v_max = self.visible_range(None, self.chunk_size)
+        # chunks are the (u, v) with u and v both even or both odd, one more diagonal each side.
+        chunks = ((u_max - u_min + 3) * (v_max - v_min + 3) + 1) // 2
+        chunk_bytes = 4 * self.chunk_size * self.tile_size.x * self.chunk_size * self.tile_size.y
+        return max(int(chunks * chunk_bytes), 32 * 1024 * 1024)
+
+    def render_chunk(self, cx, cy):
+        """ draws every terrain tile of a chunk onto a new transparent surface.
+        the chunks at the edges of the map that aren't full are still full sized. """
+        surf = pygame.Surface((
+            self.chunk_size * self.tile_size.x,
+            self.chunk_size * self.tile_size.y), pygame.SRCALPHA)
+        anchor = self.chunk_anchor(cx, cy)
+        x_start = cx * self.chunk_size
+        y_start = cy * self.chunk_size
+        x_end = min(x_start + self.chunk_size, self.map_size.x)
+        y_end = min(y_start + self.chunk_size, self.map_size.y)
+        # back to front one diagonal at a time, same as drawing tile by tile.
+        for v in range(x_start + y_start, x_end + y_end - 1):
+            for x in range(max(x_start, v - y_end + 1), min(x_end - 1, v - y_start) + 1):
+                image, tile_x, tile_y = self.terrain_at(x, v - x)
+                surf.blit(image, (tile_x - anchor.x, tile_y - anchor.y))
+        if self.stats is not None:
+            self.stats.count("tiles", max(x_end - x_start, 0) * max(y_end - y_start, 0))
+        return surf
+
+    def invalidate_tile(self, location):
+        """ throws away the cached chunk holding a tile that changed,
+        so it gets rendered again the next time it's drawn. """
+        if self.chunk_size:
+            self.chunk_cache.discard(self.chunk_of(location))
+        else: # chunks left over from before chunking was turned off are stale now.
+            self.chunk_cache.clear()
+
+    def invalidate_chunks(self):
+        """ throws away every cached chunk, e.g. after tile_size or map_origin changes,
+        along with the scroll buffer drawn from them. """
+        self.chunk_cache.clear()
+        self.scroll_surf = None
+
+    #endregion
+
+    #region batch coordinate functions
+    # numpy versions of the coordinate functions for converting lots of points at once.
+    # they take an (n, 2) array of x, y pairs, give back an (n, 2) array,
+    # and round the same way as the one point versions.
+    # numpy is imported in here so that it's only needed when these are used.
+    def to_isometric_grid_batch(self, cells):
+        """ to_isometric_grid for an array of world coordinates. """
+        import numpy as np
+        cells = np.asarray(cells)
+        x = cells[..., 0]
+        y = cells[..., 1]
+        positions = np.empty(cells.shape, dtype=np.int64)
+        # astype truncates toward zero, same as int().
+        positions[..., 0] = ((self.map_origin.x * self.tile_size.x) + (x - y) * (self.tile_size.x_half)).astype(np.int64)
+        positions[..., 1] = ((self.map_origin.y * self.tile_size.y) + (x + y) * (self.tile_size.y_half)).astype(np.int64)
+        return positions
+
+    def pick_cells_batch(self, positions):
+        """ the tile selection shared by pixelxy_to_world_coord and pixelxy_to_tilexy,
+        on arrays of pixel x and y. returns the selected cells' x and y arrays,
+        after the same four diamond-edge corner tests in the same order. """
+        import numpy as np
+        px = positions[..., 0]
+        py = positions[..., 1]
+
+        # offset into cell and base cell calculation. numpy's % and // round like python's.
+        offsetx = px % self.tile_size.x
+        offsety = py % self.tile_size.y
+        offsetx_half = 0.5 * offsetx
+        cellx = (px // self.tile_size.x) - self.map_origin.x
+        celly = (py // self.tile_size.y) - self.map_origin.y
+        selected_x = celly + cellx
+        selected_y = celly - cellx
+
+        half_h = self.tile_size.y_half
+        # np.select takes the first test that matches, like the if/elif chain.
+        corners = [
+            offsety < half_h - offsetx_half,      # top-left: west tile.
+            offsety < offsetx_half - half_h,      # top-right: north tile.
+            offsety > 3 * half_h - offsetx_half,  # bottom-right: east tile.
+            offsety > offsetx_half + half_h]      # bottom-left: south tile.
+        selected_x = selected_x + np.select(corners, [-1, 0, 1, 0], 0)
+        selected_y = selected_y + np.select(corners, [0, -1, 0, 1], 0)
+        return selected_x, selected_y
+
+    def pixelxy_to_world_coord_batch(self, positions):
+        """ pixelxy_to_world_coord for an array of screen positions.
+        pixel coords -> world coords """
+        import numpy as np
+        positions = np.asarray(positions, dtype=np.float64)
+        adjusted = positions - (self.map_offset.x, self.map_offset.y)
+        selected_x, selected_y = self.pick_cells_batch(adjusted)
+        coords = np.empty(positions.shape, dtype=np.int64)
+        coords[..., 0] = selected_x.astype(np.int64)
+        coords[..., 1] = selected_y.astype(np.int64)
+        return coords
+
+    def pixelxy_to_tilexy_batch(self, positions):
+        """ pixelxy_to_tilexy for an array of screen positions.
+        pixel coords -> pixel coords of the tiles' rects """
+        import numpy as np
+        positions = np.asarray(positions, dtype=np.float64)
+        selected_x, selected_y = self.pick_cells_batch(positions)
+        return self.to_isometric_grid_batch(np.stack((selected_x, selected_y), axis=-1))
+
+    def rebuild_tile_positions(self):
+        """ recalculates the drawing position of every tile after tile_size or map_origin changes.
+        the positions of a whole column are worked out in one go instead of calling
+        to_isometric_grid per tile. array storage doesn't store positions,
+        so only the cached chunks need throwing away there. """
+        if self.map_storage != "arrays":
+            import numpy as np
+            ys = np.arange(self.map_size.y)
+            cells = np.empty((self.map_size.y, 2), dtype=np.int64)
+            cells[:, 1] = ys
             for x in range(self.map_size.x):
-                self.drawing_surf.blit(
-                    self.map_terrain_layer[x][y].image, (
-                        self.map_terrain_layer[x][y].x + self.map_offset.x, 
-                        self.map_terrain_layer[x][y].y + self.map_offset.y, 
-                        x * self.tile_size.x, y * self.tile_size.y))
+                cells[:, 0] = x
+                positions = self.to_isometric_grid_batch(cells).tolist()
+                column = self.map_terrain_layer[x]
+                for y in range(self.map_size.y):
+                    column[y].x, column[y].y = positions[y]
+        self.invalidate_chunks()
 
     #endregion
 
     #region map generation functions
     def generate_terrain_layer(self):
         """ loads terrain layer from external file if map is fixed,
-        otherwise does dynamic level generation (not yet implemented).
-        opens a text file containing a matrix of characters,
-        loops through each character with nested loop,
-        creates a tile based on what character it finds at that x y position.
-        ensures the file is formatted correctly by striping newlines
-        and padding each line to the same length.
-        converted to 2d list and transposed to get the correct orientation. """
+        otherwise starts generating a dungeon with generate_dungeon().
+        the level file is either a text file containing a matrix of characters,
+        read by load_text_level(), or a binary level read by load_binary_level(). """
         if self.map_is_fixed:
-            with open(self.map_data, "r") as f:
-                
-                # remove newlines to get a neat matrix.
-                data = [line.rstrip("\n") for line in f]
-
-                # this ensures that carelessness when writing the file doesn't hurt.
-                # i can just type whatever and it comes out as an NxN matrix.
-                length = max(data, key=len)
-                data = [line.ljust(len(length)) for line in data]
-
-                tiles = []
-                
-                for y in range(len(data)):
-                    for x in range(len(data[y])):
-                        loc = Vec2d(x, y)
-                        cell = self.to_isometric_grid(loc)
-                        # draw different tiles here with multiple if statements.
-                        if data[y][x] == "0":
-                            # affixes x and y values in the tiles of the game map.
-                            tiles.append(Tile(self.terrain_sprites["default"], cell.x, cell.y, True))
-                        else: # default to empty tile.
-                            if data[y][x] == "P": # mark player starting location.
-                                self.map_player_location = Vec2d(x, y)
-                            tiles.append(Tile(self.terrain_sprites["empty"], cell.x, cell.y, False))
-                        
-                        # make world coordinates for each tile in the map.
-                        # https://softwareengineering.stackexchange.com/questions/212808/treating-a-1d-data-structure-as-2d-grid
-                        tiles[x+len(data[y])*y].world_coordinate.x = x
-                        tiles[x+len(data[y])*y].world_coordinate.y = y
-                
-                def list_to_2d(data, columns):
-                    if len(data) % columns != 0:
-                        print("Error: The total number of elements must be divisible by the number of columns.")
-                        return None # raises NoneType error if not divisible.
-                    return [data[i : i + columns] for i in range(0, len(data), columns)]
-                
-                def transpose(matrix):
-                    return [list(row) for row in zip(*matrix)]
-
-                tiles = list_to_2d(tiles, len(data[0]))
-                self.map_terrain_layer = transpose(tiles)
-                self.map_size.x = len(data[0])
-                self.map_size.y = len(data)
-            
-            self.map_loaded = True
-        else: # do dynamic level generation here
-            pass
-
-    def generate_object_layer(self): pass
-    def generate_entity_layer(self): pass
-    def generate_collision_layer(self): pass
+            if is_binary_level(self.map_data):
+                self.load_binary_level(self.map_data)
+            else:
+                self.load_text_level(self.map_data)
+            self.map_links = {
+                (link.location.x, link.location.y): link for link in read_level_links(self.map_data)}
+        else:
+            self.generate_dungeon()
+        self.invalidate_chunks()
+        self.map_loaded = True
+
+    def sprite_list(self):
+        """ the sprites tile type ids index into, for a TileLayer. they can still be None,
+        the layer sees them once load_sprites() fills them in. """
+        return self.layer_sprites
+
+    def load_sprites(self):
+        """ loads the sprite atlas (or gets it from the process-wide cache), if not done yet. """
+        if self.loaded_atlas is not None or self.headless:
+            return
+        self.loaded_atlas = load_atlas(self.sprite_paths)
+        self.loaded_terrain_sprites = {name: self.loaded_atlas[name] for name in TERRAIN_SPRITE_NAMES}
+        self.layer_sprites[:len(TERRAIN_SPRITE_NAMES)] = self.loaded_terrain_sprites.values()
+
+    @property
+    def sprite_atlas(self):
+        """ the SpriteAtlas, loaded the first time it's asked for. None when headless. """
+        self.load_sprites()
+        return self.loaded_atlas
+
+    @property
+    def terrain_sprites(self):
+        """ {name: sprite} of the terrain sprites, loaded the first time they're asked for.
+        all None when headless. """
+        self.load_sprites()
+        if self.loaded_terrain_sprites is None:
+            return dict.fromkeys(TERRAIN_SPRITE_NAMES)
+        return self.loaded_terrain_sprites
+
+    @staticmethod
+    def tile_kind(char):
+        """ what a character in a text level stands for:
+        the name of its terrain sprite and whether it's traversable.
+        "0" is floor, and so is "P" under the player's starting location,
+        "<" and ">" are entrances and exits (see LevelLink),
+        anything else defaults to an empty tile. """
+        if char == "0" or char == "P":
+            return "default", True
+        if char == "<" or char == ">":
+            return "corners", True
+        return "empty", False
+
+    def load_text_level(self, path):
+        """ streams a text level into the terrain layer one row at a time.
+        a first pass only measures the file, so the final column-major storage
+        (map_terrain_layer[x][y]) can be made up front at its full size,
+        and the second pass writes each row straight into it.
+        short rows are padded with empty tiles as they're written, so carelessness
+        when writing the file doesn't hurt and nothing gets copied or padded twice.
+        self.load_progress, if set, is called with (rows loaded, total rows) after each row. """
+        width, height = level_dimensions(path)
+        self.map_size.x = width
+        self.map_size.y = height
+
+        if self.map_storage == "arrays":
+            # no Tiles at all. each row's characters are translated to ids and flags
+            # and written down its column with one slice assignment.
+            layer = TileLayer(self, width, height, self.sprite_list())
+            id_table, flag_table = level_row_tables(self.tile_kind)
+            for y, row in enumerate(level_rows(path)):
+                if len(row) < width:
+                    row = row.ljust(width)
+                layer.ids[y::height] = array("H", list(row.translate(id_table)))
+                layer.flags[y::height] = row.translate(flag_table)
+                if b"P" in row: # mark player starting location.
+                    self.map_player_location = Vec2d(row.rindex(b"P"), y)
+                if self.load_progress:
+                    self.load_progress(y + 1, height)
+            self.map_terrain_layer = layer
+            return
+
+        sprites = {}
+        for char in range(256):
+            name, traversable = self.tile_kind(chr(char))
+            sprites[char] = (self.terrain_sprites[name], traversable)
+        columns = [[None] * height for x in range(width)]
+        for y, row in enumerate(level_rows(path)):
+            if len(row) < width:
+                row = row.ljust(width)
+            if b"P" in row: # mark player starting location.
+                self.map_player_location = Vec2d(row.rindex(b"P"), y)
+            for x in range(width):
+                image, traversable = sprites[row[x]]
+                cell = self.to_isometric_grid(Vec2d(x, y))
+                tile = Tile(image, cell.x, cell.y, traversable)
+                # world coordinates for identifying each tile in the map.
+                tile.world_coordinate.x = x
+                tile.world_coordinate.y = y
+                columns[x][y] = tile
+            if self.load_progress:
+                self.load_progress(y + 1, height)
+        self.map_terrain_layer = columns
+
+    def load_binary_level(self, path):
+        """ opens a binary level (see convert_text_level) through mmap.
+        with array storage the terrain layer's ids and flags are views straight into
+        the mapped file, so nothing is parsed and only the pages that get drawn are read.
+        the mapping is copy-on-write: processes loading the same level share its pages,
+        and editing tiles never writes back to the file. """
+        with open(path, "rb") as f:
+            level = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        width, height, layer_count, id_width, player_start = read_level_header(level)
+        self.map_size.x = width
+        self.map_size.y = height
+        if player_start is not None:
+            self.map_player_location = player_start
+
+        cells = width * height
+        ids_start = LEVEL_HEADER.size
+        flags_start = ids_start + cells * id_width
+        data = memoryview(level)
+        ids = data[ids_start:flags_start].cast("B" if id_width == 1 else "H")
+        flags = data[flags_start:flags_start + cells]
+        if id_width == 2 and sys.byteorder != "little":
+            ids = array("H", ids.tobytes())
+            ids.byteswap()
+
+        if self.map_storage == "arrays":
+            self.map_file = level
+            self.map_terrain_layer = TileLayer(self, width, height, self.sprite_list(), ids, flags)
+            if self.load_progress:
+                self.load_progress(height, height)
+            return
+
+        sprites = list(self.terrain_sprites.values())
+        columns = []
+        for x in range(width):
+            column = []
+            for y in range(height):
+                i = x * height + y
+                cell = self.to_isometric_grid(Vec2d(x, y))
+                tile = Tile(sprites[ids[i]], cell.x, cell.y, bool(flags[i] & TRAVERSABLE))
+                tile.world_coordinate.x = x
+                tile.world_coordinate.y = y
+                column.append(tile)
+            columns.append(column)
+            if self.load_progress:
+                self.load_progress(x + 1, width)
+        self.map_terrain_layer = columns
+        # the Tiles hold everything now, so the file can go.
+        if isinstance(ids, memoryview):
+            ids.release()
+        flags.release()
+        data.release()
+        level.close()
+
+    def generate_object_layer(self):
+        """ objects lying on the map, kept in a SpatialHash by world coordinate.
+        use add_object() and remove_object() to change it. """
+        self.map_object_layer = SpatialHash()
+
+    def generate_entity_layer(self):
+        """ monsters and other things moving around the map, kept in a SpatialHash
+        by world coordinate. use add_entity(), move_entity() and remove_entity() to change it. """
+        self.map_entity_layer = SpatialHash()
+
+    def generate_collision_layer(self):
+        """ the collision layer is a CollisionLayer, with static bits copied from
+        the terrain's traversable flags and solid entities taken off the walkable bits. """
+        if self.map_storage == "arrays":
+            flags = self.map_terrain_layer.flags
+        else:
+            flags = bytes(
+                TRAVERSABLE if tile.traversable else 0
+                for column in self.map_terrain_layer for tile in column)
+        self.map_collision_layer = CollisionLayer(
+            self.map_size.x, self.map_size.y, CollisionLayer.pack(flags))
+        for layer in (self.map_object_layer, self.map_entity_layer):
+            for thing in layer:
+                if thing.solid:
+                    self.map_collision_layer.occupy(int(thing.world_coordinate.x), int(thing.world_coordinate.y))
+        self.collision_changed()
+
+    def set_traversable(self, location, traversable):
+        """ changes whether a world coordinate can be walked on,
+        in the collision layer and the terrain tile both. """
+        if self.map_collision_layer.is_static(location.x, location.y) == traversable:
+            return
+        self.map_collision_layer.set_static(location.x, location.y, traversable)
+        if self.map_storage == "arrays":
+            i = location.x * self.map_size.y + location.y
+            if traversable:
+                self.map_terrain_layer.flags[i] |= TRAVERSABLE
+            else:
+                self.map_terrain_layer.flags[i] &= ~TRAVERSABLE
+        else:
+            self.map_terrain_layer[location.x][location.y].traversable = traversable
+        self.collision_changed()
+
+    def collision_changed(self):
+        """ throws away everything worked out from the collision layer after it changed:
+        any cached path could run through a changed cell, and it may block sight now.
+        the path cache, the pathfinding regions and grid are dropped, and the flow field
+        and field of view remade the next time they're used. """
+        self.path_cache.clear()
+        self.path_regions = None
+        self.path_grid = None
+        self.flow_field_stale = True
+        self.fov_stale = True
     
     def inside_world_bounds(self, position):
-        cell = Vec2d(position.x // self.tile_size.x, position.y // self.tile_size.y)
-        selected = Vec2d(
-            (cell.y - self.map_origin.y) + (cell.x - self.map_origin.x),
-            (cell.y - self.map_origin.y) - (cell.x - self.map_origin.x))
-        
-        return (selected.x >= 0 and selected.x < self.map_size.x and 
-                selected.y >= 0 and selected.y < self.map_size.y)
+        """ whether the tile under a screen position is on the map. """
+        location = self.pixelxy_to_world_coord(position)
+        return self.map_collision_layer.in_bounds(location.x, location.y)
+
+    def can_move(self, location, direction):
+        """ whether one step in a map_move direction from a world coordinate stays on the map
+        and lands on a walkable tile, without cutting a blocked corner diagonally.
+        cheap enough to call every frame. """
+        dx, dy = DIRECTIONS[direction]
+        collision = self.map_collision_layer
+        x, y = location.x + dx, location.y + dy
+        if not collision.is_walkable(x, y):
+            return False
+        if dx and dy:
+            return collision.is_walkable(x, location.y) and collision.is_walkable(location.x, y)
+        return True
     
     #endregion
 
+    #region entity and object functions
+    def add_object(self, thing):
+        """ puts an Entity on the object layer at its world_coordinate. """
+        self.map_object_layer.insert(thing, thing.world_coordinate)
+        self.static_order = None
+        self.occupy(thing)
+        self.mark_entity_dirty(thing)
+
+    def remove_object(self, thing):
+        self.mark_entity_dirty(thing)
+        self.vacate(thing)
+        self.map_object_layer.remove(thing)
+        self.static_order = None
+
+    def add_entity(self, entity):
+        """ puts an Entity on the entity layer at its world_coordinate. """
+        self.map_entity_layer.insert(entity, entity.world_coordinate)
+        self.occupy(entity)
+        self.mark_entity_dirty(entity)
+
+    def move_entity(self, entity, location):
+        """ moves an entity to another world coordinate, updating the index in O(1)
+        and the collision layer only for the tiles it left and entered. """
+        self.mark_entity_dirty(entity)
+        old = entity.world_coordinate
+        moved_tiles = int(old.x) != int(location.x) or int(old.y) != int(location.y)
+        if moved_tiles:
+            self.vacate(entity)
+        entity.world_coordinate = location
+        self.map_entity_layer.move(entity, location)
+        if moved_tiles:
+            self.occupy(entity)
+        self.mark_entity_dirty(entity)
+
+    def remove_entity(self, entity):
+        self.mark_entity_dirty(entity)
+        self.vacate(entity)
+        self.map_entity_layer.remove(entity)
+
+    def occupy(self, thing):
+        """ takes the tile a solid thing stands on off the walkable bits. """
+        if thing.solid:
+            self.map_collision_layer.occupy(int(thing.world_coordinate.x), int(thing.world_coordinate.y))
+
+    def vacate(self, thing):
+        if thing.solid:
+            self.map_collision_layer.vacate(int(thing.world_coordinate.x), int(thing.world_coordinate.y))
+
+    def mark_entity_dirty(self, thing):
+        """ in dirty rect mode, marks where an object or entity is drawn for a redraw. """
+        if self.dirty_rect_mode:
+            self.mark_dirty(self.entity_rect(thing))
+
+    def entity_at_pixel(self, position, precise=True):
+        """ hit test: returns the object or entity drawn on top at a screen position, or None.
+        only things near the tile under the position are looked at, topmost first
+        in the depth order of things_in_view(), and the first one hit wins.
+        when precise, a thing is only hit where its sprite isn't see-through (see sprite_mask),
+        so clicking a monster standing over a tile picks the monster, and clicking next to it
+        inside its rect picks whatever is behind. otherwise the whole rect counts.
+        things hidden by the field of view can't be hit. """
+        location = self.pixelxy_to_world_coord(position)
+        reach = self.sprite_reach + 1
+        candidates = []
+        for layer_order, layer in enumerate((self.map_object_layer, self.map_entity_layer)):
+            for thing in layer.in_rect(location.x - reach, location.y - reach, location.x + reach, location.y + reach):
+                if not self.in_sight(thing, layer_order == 0):
+                    continue
+                # later ones on the same diagonal and layer are drawn over earlier ones.
+                candidates.append((thing.world_coordinate.x + thing.world_coordinate.y, layer_order, len(candidates), thing))
+        candidates.sort(reverse=True)
+        x = math.floor(position.x)
+        y = math.floor(position.y)
+        for depth, layer_order, i, thing in candidates:
+            rect = self.entity_rect(thing)
+            if rect.collidepoint(x, y) and (
+                    not precise or sprite_mask(thing.image).get_at((x - rect.x, y - rect.y))):
+                return thing
+        return None
+
+    #endregion
+
+    #region entrance and exit functions
+    def link_at(self, location):
+        """ the LevelLink of the entrance or exit at a world coordinate, or None. """
+        return self.map_links.get((location.x, location.y))
+
+    def links_near(self, location, radius):
+        """ the LevelLinks within radius tiles of a world coordinate, diagonals counting as one. """
+        return [link for link in self.map_links.values()
+                if max(abs(link.location.x - location.x), abs(link.location.y - location.y)) <= radius]
+
+    def center_on(self, location):
+        """ moves the camera so the tile at a world coordinate is under the viewport center,
+        and puts the player there, e.g. arriving on a level through an entrance. """
+        tile = self.to_isometric_grid(location)
+        self.map_offset = Vec2d(
+            int(int(self.viewport_size.x_half) - tile.x - self.tile_size.x_half),
+            int(int(self.viewport_size.y_half) - tile.y - self.tile_size.y_half))
+        self.map_player_location = Vec2d(location.x, location.y)
+        self.moving = False
+        self.dirty_all = True
+
+    #endregion
+
+    #region pathfinding functions
+    def find_path(self, start, goal, limit=None):
+        """ finds the shortest walkable path between two world coordinates with A*.
+        returns a list of world coordinates from start to goal, both included,
+        or an empty list when there's no way there.
+        moves go in the 8 directions of map_move, see DIRECTIONS. diagonal moves can't
+        cut the corner of a tile that isn't traversable. the start tile doesn't need
+        to be traversable itself, so the player can always leave wherever they are.
+        paths go around the terrain, not around solid entities, which move every frame
+        anyway. that way paths are cached until the terrain's collision changes.
+        goals in another region than the start (see CollisionLayer.regions) are known
+        to be out of reach without searching.
+        limit caps how many tiles the search looks at, for long paths that don't need to be
+        exact right away: past it, the path leads to the tile it got nearest the goal,
+        to be continued with another find_path() from there. """
+        width, height = self.map_size.x, self.map_size.y
+        if not (0 <= start.x < width and 0 <= start.y < height and
+                0 <= goal.x < width and 0 <= goal.y < height):
+            return []
+        key = (start.x * height + start.y, goal.x * height + goal.y, limit)
+        path = self.path_cache.get(key)
+        if self.stats is not None:
+            self.stats.count("path_cache_misses" if path is None else "path_cache_hits")
+        if path is not None:
+            self.path_cache.move_to_end(key)
+        else:
+            if self.path_regions is None:
+                self.path_regions = self.map_collision_layer.regions()
+            start_region = self.path_regions[key[0]]
+            # a start that can't be walked on isn't in a region, so it's searched from anyway.
+            if start_region and start_region != self.path_regions[key[1]]:
+                path = ()
+            else:
+                path = self.search_path(*key)
+            self.path_cache[key] = path
+            if len(self.path_cache) > self.path_cache_size:
+                self.path_cache.popitem(last=False)
+        return [Vec2d(*divmod(i, height)) for i in path]
+
+    def search_path(self, start, goal, limit=None):
+        """ A* between two cells given as flat indices (x * height + y),
+        so the search only handles ints and never builds Vec2ds.
+        the open set is a heap ordered by estimated total cost, with the octile distance as
+        the estimate, and ties going to the cell nearest the goal so open ground isn't
+        searched wide. it walks path_grid, a byte per cell with a border around the map,
+        so a neighbor needs no bounds checks, and the per-cell scores live in flat lists kept
+        between searches (path_search), marked with a new generation each search
+        instead of being cleared or reallocated.
+        after expanding limit cells it gives up and returns the path to the cell it got
+        nearest the goal, see find_path(). returns a tuple of indices. """
+        height = self.map_size.y
+        if self.path_grid is None:
+            self.path_grid = self.map_collision_layer.padded()
+        grid = self.path_grid
+        # indices into the padded grid from here on.
+        padded_height = height + 2
+        start = start + 2 * (start // height) + padded_height + 1
+        goal = goal + 2 * (goal // height) + padded_height + 1
+        if not grid[goal]:
+            return ()
+        goal_x, goal_y = divmod(goal, padded_height)
+        diagonal = math.sqrt(2)
+        diagonal_extra = diagonal - 2
+
+        # index steps of each direction, diagonals with the two orthogonal steps they pass between.
+        straight_moves = []
+        diagonal_moves = []
+        for dx, dy in DIRECTIONS.values():
+            if dx and dy:
+                diagonal_moves.append((dx * padded_height + dy, dx * padded_height, dy))
+            else:
+                straight_moves.append(dx * padded_height + dy)
+
+        cells = len(grid)
+        if self.path_search is None or len(self.path_search[1]) != cells:
+            self.path_search = [0, [0] * cells, [0.0] * cells, [0] * cells]
+        # marks[i] is seen when g_score[i] and came_from[i] are from this search,
+        # and closed once the cell has been expanded.
+        self.path_search[0] += 2
+        generation, marks, g_score, came_from = self.path_search
+        seen = generation
+        closed = generation + 1
+
+        def trace(current):
+            path = [current]
+            while current != start:
+                current = came_from[current]
+                path.append(current)
+            path.reverse()
+            return tuple(i - padded_height - 1 - 2 * ((i - padded_height) // padded_height) for i in path)
+
+        marks[start] = seen
+        g_score[start] = 0
+        open_heap = [(0, math.inf, start)]
+        nearest = (math.inf, start) # (estimate, cell) of the expanded cell nearest the goal.
+        expanded = 0
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        while open_heap:
+            estimate, current = heappop(open_heap)[1:]
+            if current == goal:
+                return trace(current)
+            if marks[current] == closed:
+                continue
+            marks[current] = closed
+            if limit is not None:
+                if estimate < nearest[0]:
+                    nearest = (estimate, current)
+                expanded += 1
+                if expanded > limit:
+                    return trace(nearest[1])
+            current_g = g_score[current]
+            g = current_g + 1
+            for step in straight_moves:
+                neighbor = current + step
+                if not grid[neighbor] or marks[neighbor] == closed:
+                    continue
+                if marks[neighbor] != seen or g < g_score[neighbor]:
+                    marks[neighbor] = seen
+                    g_score[neighbor] = g
+                    came_from[neighbor] = current
+                    dist_x, dist_y = divmod(neighbor, padded_height)
+                    dist_x = abs(dist_x - goal_x)
+                    dist_y = abs(dist_y - goal_y)
+                    estimate = dist_x + dist_y + diagonal_extra * (dist_x if dist_x < dist_y else dist_y)
+                    heappush(open_heap, (g + estimate, estimate, neighbor))
+            g = current_g + diagonal
+            for step, side_a, side_b in diagonal_moves:
+                neighbor = current + step
+                if (not grid[neighbor] or not grid[current + side_a] or not grid[current + side_b]
+                        or marks[neighbor] == closed):
+                    continue
+                if marks[neighbor] != seen or g < g_score[neighbor]:
+                    marks[neighbor] = seen
+                    g_score[neighbor] = g
+                    came_from[neighbor] = current
+                    dist_x, dist_y = divmod(neighbor, padded_height)
+                    dist_x = abs(dist_x - goal_x)
+                    dist_y = abs(dist_y - goal_y)
+                    estimate = dist_x + dist_y + diagonal_extra * (dist_x if dist_x < dist_y else dist_y)
+                    heappush(open_heap, (g + estimate, estimate, neighbor))
+        return ()
+
+    #endregion
+
+    #region flow field functions
+    def update_flow_field(self):
+        """ remakes the flow field if the player changed tiles or the collision layer changed.
+        the flow field is a Dijkstra map: for every tile, how many moves it takes to reach the
+        player, or -1 if it can't within flow_field_radius. one field serves every monster,
+        which then only has to look at its neighbors to step toward the player (flow_step).
+
+        it's a breadth first search done a whole wave at a time with numpy:
+        each wave moves the previous wave's cells in all 8 directions at once,
+        keeping the ones that are traversable and not reached yet.
+        only the square within flow_field_radius of the player is searched,
+        so the cost depends on the radius and not the size of the map. """
+        width, height = self.map_size.x, self.map_size.y
+        player = self.map_player_location
+        source = player.x * height + player.y
+        if (self.flow_field is not None and not self.flow_field_stale
+                and source == self.flow_field_source):
+            return
+
+        import numpy as np
+        self.flow_field_source = source
+        self.flow_field_stale = False
+        if not (0 <= player.x < width and 0 <= player.y < height):
+            self.flow_field = np.full((0, 0), -1, dtype=np.int32)
+            self.flow_field_origin = (0, 0)
+            return
+
+        # the searched square and the player's place in it.
+        radius = self.flow_field_radius
+        left, top = max(player.x - radius, 0), max(player.y - radius, 0)
+        right, bottom = min(player.x + radius + 1, width), min(player.y + radius + 1, height)
+        # unpack just the square from the static bits, a byte range per column.
+        static = np.frombuffer(self.map_collision_layer.static, dtype=np.uint8)
+        first_bits = np.arange(left, right) * height + top
+        span = ((bottom - top) + 7 >> 3) + 1
+        byte_indices = np.minimum((first_bits >> 3)[:, None] + np.arange(span), len(static) - 1)
+        bits = np.unpackbits(static[byte_indices], axis=1, bitorder="little")
+        walkable = np.take_along_axis(
+            bits, (first_bits & 7)[:, None] + np.arange(bottom - top), axis=1).astype(bool)
+
+        def moved(cells, dx, dy):
+            """ cells moved dx, dy over, with nothing coming in from outside the square. """
+            result = np.zeros_like(cells)
+            w, h = cells.shape
+            result[max(dx, 0):w + min(dx, 0), max(dy, 0):h + min(dy, 0)] = \
+                cells[max(-dx, 0):w + min(-dx, 0), max(-dy, 0):h + min(-dy, 0)]
+            return result
+
+        # the cells each move can start from. diagonal moves can't cut a blocked corner,
+        # same as find_path, so both tiles they pass between have to be traversable.
+        moves = []
+        for dx, dy in DIRECTIONS.values():
+            if dx and dy:
+                moves.append((dx, dy, moved(walkable, -dx, 0) & moved(walkable, 0, -dy)))
+            else:
+                moves.append((dx, dy, None))
+
+        distance = np.full(walkable.shape, -1, dtype=np.int32)
+        wave = np.zeros(walkable.shape, dtype=bool)
+        wave[player.x - left, player.y - top] = True
+        distance[wave] = 0
+        moves_taken = 0
+        while True:
+            moves_taken += 1
+            reached = np.zeros_like(wave)
+            for dx, dy, allowed in moves:
+                reached |= moved(wave if allowed is None else wave & allowed, dx, dy)
+            wave = reached & walkable & (distance < 0)
+            if not wave.any():
+                break
+            distance[wave] = moves_taken
+        self.flow_field = distance
+        self.flow_field_origin = (left, top)
+
+    def flow_field_at(self, x, y):
+        """ the flow field's distance at a world coordinate, -1 outside the searched square. """
+        x -= self.flow_field_origin[0]
+        y -= self.flow_field_origin[1]
+        field = self.flow_field
+        if not (0 <= x < field.shape[0] and 0 <= y < field.shape[1]):
+            return -1
+        return int(field[x, y])
+
+    def flow_distance(self, location):
+        """ how many moves a world coordinate is from the player, -1 if it can't get there. """
+        self.update_flow_field()
+        return self.flow_field_at(location.x, location.y)
+
+    def flow_step(self, location):
+        """ the next world coordinate on the way to the player from location,
+        the neighbor that's the fewest moves away. returns location itself when there's
+        no way closer, e.g. it's already on the player or can't reach them. """
+        self.update_flow_field()
+        collision = self.map_collision_layer
+        best = self.flow_field_at(location.x, location.y)
+        step = location
+        if best <= 0:
+            return step
+        for dx, dy in DIRECTIONS.values():
+            x, y = location.x + dx, location.y + dy
+            distance = self.flow_field_at(x, y)
+            if distance < 0 or distance >= best:
+                continue
+            if dx and dy and not (collision.is_static(x, location.y) and
+                                  collision.is_static(location.x, y)):
+                continue
+            best = distance
+            step = Vec2d(x, y)
+        return step
+
+    #endregion
+
+    #region field of view functions
+    def update_fov(self):
+        """ remakes the field of view if the player changed tiles or the collision layer changed,
+        see FieldOfView.compute(). only the tiles within fov_radius of the player are looked at,
+        so the cost depends on the radius and not the size of the map. """
+        if self.fov_radius is None:
+            return
+        width, height = self.map_size.x, self.map_size.y
+        player = self.map_player_location
+        source = player.x * height + player.y
+        if (self.fov is not None and not self.fov_stale and source == self.fov_source
+                and self.fov.width == width and self.fov.height == height):
+            return
+        with self.phase("fov"):
+            if self.fov is None or self.fov.width != width or self.fov.height != height:
+                self.fov = FieldOfView(width, height)
+            self.fov.compute(self.map_collision_layer, player, self.fov_radius)
+        self.fov_source = source
+        self.fov_stale = False
+        self.dirty_all = True # the fog moved.
+        if self.stats is not None:
+            self.stats.count("fov_tiles", len(self.fov.lit))
+
+    def in_sight(self, thing, remembered=False):
+        """ whether the field of view lets an object or entity be seen: while its tile is
+        in sight, or for remembered things like objects, once its tile has been seen.
+        always True with the field of view off. """
+        if self.fov_radius is None:
+            return True
+        self.update_fov()
+        x, y = int(thing.world_coordinate.x), int(thing.world_coordinate.y)
+        return self.fov.is_visible(x, y) or (remembered and self.fov.is_explored(x, y))
+
+    #endregion
+
+    #region dungeon generation functions
+    def generate_dungeon(self):
+        """ starts generating a dungeon_size dungeon from map_seed without waiting for it.
+        the map starts out as solid wall, and every chunk (see generate_dungeon_chunk)
+        is handed to the executor nearest to the player's starting tile
+        (see dungeon_start) first, and the camera is centered on that tile.
+        update() puts finished chunks into the terrain and collision layers as they come in,
+        so the area around the player is playable long before a big dungeon is done. """
+        width, height = self.dungeon_size.x, self.dungeon_size.y
+        self.map_size.x = width
+        self.map_size.y = height
+        wall_id = TERRAIN_SPRITE_NAMES.index("empty")
+        if self.map_storage == "arrays":
+            self.map_terrain_layer = TileLayer(self, width, height, self.sprite_list(),
+                array("H", [wall_id]) * (width * height))
+        else:
+            wall = self.terrain_sprites["empty"]
+            columns = []
+            for x in range(width):
+                column = []
+                for y in range(height):
+                    cell = self.to_isometric_grid(Vec2d(x, y))
+                    tile = Tile(wall, cell.x, cell.y, False)
+                    tile.world_coordinate.x = x
+                    tile.world_coordinate.y = y
+                    column.append(tile)
+                columns.append(column)
+            self.map_terrain_layer = columns
+
+        # the start only depends on the seed and size, the camera is moved to it
+        # rather than the other way around so the viewport doesn't change the dungeon.
+        start = dungeon_start(self.map_seed, width, height)
+        self.center_on(Vec2d(*start))
+        start_chunk = (start[0] // DUNGEON_CHUNK_SIZE, start[1] // DUNGEON_CHUNK_SIZE)
+        chunks = [(cx, cy)
+            for cx in range(-(-width // DUNGEON_CHUNK_SIZE))
+            for cy in range(-(-height // DUNGEON_CHUNK_SIZE))]
+        chunks.sort(key=lambda chunk: max(abs(chunk[0] - start_chunk[0]), abs(chunk[1] - start_chunk[1])))
+
+        executor = self.dungeon_executor or shared_dungeon_executor()
+        self.cancel_dungeon()
+        self.pending_chunks = [
+            executor.submit(generate_dungeon_chunk, self.map_seed, cx, cy, width, height,
+                DUNGEON_CHUNK_SIZE, start)
+            for cx, cy in chunks]
+
+    def collect_dungeon_chunks(self, limit=None):
+        """ puts finished dungeon chunks into the map, at most limit of them
+        (all that are done if None), without waiting on the ones that aren't.
+        chunks are taken in the order they were submitted, so the nearest come in first.
+        returns how many were put in. """
+        collected = 0
+        while self.pending_chunks and (limit is None or collected < limit):
+            if not self.pending_chunks[0].done():
+                break
+            self.apply_dungeon_chunk(*self.pending_chunks.pop(0).result())
+            collected += 1
+        return collected
+
+    def finish_dungeon(self):
+        """ waits for the rest of the dungeon and puts all of it into the map. """
+        while self.pending_chunks:
+            self.apply_dungeon_chunk(*self.pending_chunks.pop(0).result())
+
+    def cancel_dungeon(self):
+        """ stops generating chunks that haven't been started, e.g. before a new level. """
+        for future in self.pending_chunks:
+            future.cancel()
+        self.pending_chunks = []
+
+    def dungeon_done(self):
+        return not self.pending_chunks
+
+    def apply_dungeon_chunk(self, cx, cy, ids, flags):
+        """ writes a chunk returned by generate_dungeon_chunk into the terrain and collision
+        layers, and throws away whatever was drawn from the walls that were there before. """
+        width, height = self.map_size.x, self.map_size.y
+        left = cx * DUNGEON_CHUNK_SIZE
+        top = cy * DUNGEON_CHUNK_SIZE
+        w = min(DUNGEON_CHUNK_SIZE, width - left)
+        h = min(DUNGEON_CHUNK_SIZE, height - top)
+        collision = self.map_collision_layer
+        if self.map_storage != "arrays":
+            sprites = list(self.terrain_sprites.values())
+        for lx in range(w):
+            x = left + lx
+            column_ids = ids[lx * h:(lx + 1) * h]
+            column_flags = flags[lx * h:(lx + 1) * h]
+            if self.map_storage == "arrays":
+                i = x * height + top
+                self.map_terrain_layer.ids[i:i + h] = array("H", list(column_ids))
+                self.map_terrain_layer.flags[i:i + h] = column_flags
+            else:
+                column = self.map_terrain_layer[x]
+                for ly in range(h):
+                    tile = column[top + ly]
+                    tile.image = sprites[column_ids[ly]]
+                    tile.traversable = bool(column_flags[ly] & TRAVERSABLE)
+            for ly in range(h):
+                collision.set_static(x, top + ly, column_flags[ly] & TRAVERSABLE)
+
+        if self.chunk_size:
+            for chunk_x in range(left // self.chunk_size, (left + w - 1) // self.chunk_size + 1):
+                for chunk_y in range(top // self.chunk_size, (top + h - 1) // self.chunk_size + 1):
+                    self.chunk_cache.discard((chunk_x, chunk_y))
+        else:
+            self.chunk_cache.clear()
+        view_left, view_top, view_right, view_bottom = self.visible_world_rect(
+            (-self.scroll_margin.x, -self.scroll_margin.y,
+             self.viewport_size.x + 2 * self.scroll_margin.x,
+             self.viewport_size.y + 2 * self.scroll_margin.y))
+        if left <= view_right and left + w > view_left and top <= view_bottom and top + h > view_top:
+            self.scroll_surf = None
+            self.dirty_all = True
+        self.collision_changed()
+
+    #endregion
+
+    #region instrumentation functions
+    def enable_stats(self, history=120):
+        """ starts recording per-frame timings and counts in self.stats, a FrameStats
+        keeping the last history frames. call end_frame() once at the end of every frame. """
+        self.stats = FrameStats(history)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    def phase(self, name):
+        """ context manager timing a phase of the frame while stats are on, e.g.
+            with area.phase("picking"):
+                location = area.pixelxy_to_world_coord(mouse)
+        update() and draw() time themselves as "update" and "draw".
+        does nothing when stats are off. """
+        if self.stats is None:
+            return NO_PHASE
+        return PhaseTimer(self.stats, name)
+
+    def end_frame(self):
+        """ ends the frame being recorded, starting or stopping the profiler
+        if profile_frames() asked for it. returns the finished frame's record, or None
+        when stats are off. """
+        stats = self.stats
+        if stats is None:
+            return None
+        record = stats.end_frame()
+        if stats.profile_window is not None:
+            first, last, start, stop = stats.profile_window
+            if stats.frame == first:
+                start()
+            elif stats.frame == last + 1:
+                stop()
+                stats.profile_window = None
+        return record
+
+    def profile_frames(self, first, count, start=None, stop=None):
+        """ runs a profiler during frames first to first + count - 1 (counted by end_frame()).
+        start and stop are called right before the first of those frames and right after
+        the last, e.g. a sampling profiler's start and stop methods.
+        without them cProfile is used, and the cProfile.Profile is returned, to read with pstats
+        once the frames are over. turns stats on if they were off. """
+        stats = self.stats or self.enable_stats()
+        profile = None
+        if start is None:
+            import cProfile
+            profile = cProfile.Profile()
+            start, stop = profile.enable, profile.disable
+        if stats.frame == first:
+            start()
+        stats.profile_window = (first, first + count - 1, start, stop)
+        return profile
+
+    def memory_size(self):
+        """ roughly how many bytes the map takes up: its layers, the bitsets and fields kept per cell,
+        and the chunk cache. the terrain of a memory-mapped binary level is left out,
+        its pages belong to the file until they're edited. see LevelManager's memory budget. """
+        cells = self.map_size.x * self.map_size.y
+        if self.map_storage != "arrays":
+            size = cells * TILE_BYTES
+        elif self.map_file is None:
+            size = cells * (self.map_terrain_layer.ids.itemsize + 1)
+        else:
+            size = 0
+        size += cells // 4 # collision static and walkable bits.
+        if self.fov is not None:
+            size += cells // 4
+        if self.flow_field is not None:
+            size += self.flow_field.nbytes
+        return size + self.chunk_cache.used
+
+    def draw_stats(self, surf=None, font=None, position=Vec2d(12, 12), color=(0, 0, 0)):
+        """ draws FrameStats.summary() as lines of text, like the debug text in main.py.
+        surf defaults to drawing_surf, font to pygame's default font. """
+        if self.stats is None or self.headless:
+            return
+        if surf is None:
+            surf = self.drawing_surf
+        if font is None:
+            if self.stats.font is None:
+                if not pygame.font.get_init():
+                    pygame.font.init()
+                self.stats.font = pygame.font.Font(None, 24)
+            font = self.stats.font
+        with self.phase("overlay"):
+            y = position.y
+            for line in self.stats.summary():
+                surf.blit(font.render(line, True, color), (position.x, y))
+                y += font.get_linesize()
+
+    #endregion
+
     def print_world_coords(self): # debug
         for x in range(self.map_size.x):
             for y in range(self.map_size.y):
                 tile = self.map_terrain_layer[x][y]
                 print(f"Tile at [{x}, {y}] has world coords [{int(tile.world_coordinate.x)}, {int(tile.world_coordinate.y)}] and pixel position [{tile.x}, {tile.y}]")
 
-    def update(self):
-        """ for updating all map layers at once. 
-        handles animation of map movement over multiple frames. """
-        if self.moving and self.animation_frames_remaining > 0:
-            # apply the increment for this frame.
-            self.map_offset.x += self.animation_increment.x
-            self.map_offset.y += self.animation_increment.y
-            
-            self.animation_frames_remaining -= 1
-            
-            # stop animation when complete and update player location.
-            if self.animation_frames_remaining == 0:
-                self.moving = False
-                # update player's world coordinate based on center of viewport.
-                center_position = Vec2d(
-                    int(self.viewport_size.x_half),
-                    int(self.viewport_size.y_half))
-                self.map_player_location = self.pixelxy_to_world_coord(center_position)
+    def update(self, elapsed=None):
+        """ for updating all map layers at once.
+        elapsed is the time in seconds since the last update(), and one simulation step
+        (sim_step) when left out, so calling it once per frame without it still moves
+        a tile every move_steps frames like it always has.
+
+        the simulation runs in whole steps, see simulate_step(), as many as the elapsed time
+        (times time_scale) adds up to. after a slow frame several steps run at once,
+        so drawing can fall behind and skip frames while movement keeps its speed;
+        past max_sim_steps the rest of the time is dropped instead, so one long stall
+        doesn't snowball. map_offset is then interpolated between the last step and the next
+        by the leftover time. also hands over the dungeon chunks that finished generating.
+        returns the number of steps run. """
+        with self.phase("update"):
+            if self.pending_chunks:
+                self.collect_dungeon_chunks(self.chunks_per_update)
+            if elapsed is None:
+                elapsed = self.sim_step
+            self.sim_accumulator += elapsed * self.time_scale
+            steps = 0
+            while self.sim_accumulator >= self.sim_step:
+                if self.max_sim_steps is not None and steps == self.max_sim_steps:
+                    self.sim_accumulator %= self.sim_step
+                    break
+                self.sim_accumulator -= self.sim_step
+                self.simulate_step()
+                steps += 1
+            if self.moving:
+                self.interpolate_offset(self.sim_accumulator / self.sim_step)
+            return steps
+
+    def simulate_step(self):
+        """ advances the simulation by one fixed step of sim_step seconds:
+        moves the current map movement along, and once it's done puts the player
+        on the tile under the viewport center. """
+        self.sim_time += self.sim_step
+        if not self.moving:
+            return
+        self.animation_steps_done += 1
+        self.interpolate_offset(0)
+        # stop animation when complete and update player location.
+        if self.animation_steps_done >= self.move_steps:
+            self.moving = False
+            # update player's world coordinate based on center of viewport.
+            center_position = Vec2d(
+                int(self.viewport_size.x_half),
+                int(self.viewport_size.y_half))
+            self.map_player_location = self.pixelxy_to_world_coord(center_position)
+            # the player is on a new tile, so whatever chases them needs a new field,
+            # and they see something else.
+            if self.flow_field is not None:
+                self.update_flow_field()
+            if self.fov_radius is not None:
+                self.update_fov()
+
+    def interpolate_offset(self, fraction):
+        """ puts map_offset where the current movement is, fraction of a step past
+        the last simulated step. """
+        progress = min((self.animation_steps_done + fraction) / self.move_steps, 1)
+        self.map_offset.x = self.animation_start_offset.x + self.animation_target_offset.x * progress
+        self.map_offset.y = self.animation_start_offset.y + self.animation_target_offset.y * progress
+        self.dirty_all = True
 
 #endregion
 
-pygame.quit()
+#region level management
+class LevelManager:
+    """ keeps the TileMap of the level the player is on in current, and has the levels
+    its entrances and exits lead to loaded ahead of time, so going through one
+    swaps maps without stopping to load.
+
+    while the player is within prefetch_radius tiles of an entrance or exit, update() loads
+    the level it leads to on a background thread. loaded levels are kept, so going back
+    finds a level as it was left, until they add up to more than memory_budget bytes
+    (see TileMap.memory_size). then the levels not linked from the current one are dropped
+    first, least recently used first, and the linked ones after that. the current one stays.
+    options are passed on to every TileMap made. """
+    def __init__(self, drawing_surf, viewport_size, level, memory_budget=256 * 1024 * 1024,
+                 prefetch_radius=8, executor=None, **options):
+        self.drawing_surf = drawing_surf
+        self.viewport_size = viewport_size
+        self.options = options
+        self.memory_budget = memory_budget
+        self.prefetch_radius = prefetch_radius
+        # a concurrent.futures executor to load levels on, or a thread of our own made when needed.
+        self.executor = executor
+        self.own_executor = None
+        self.levels = OrderedDict() # path -> TileMap, least recently used first.
+        self.pending = {} # path -> future of a TileMap being loaded.
+        self.failed = {} # path -> what went wrong loading it in the background.
+        self.load_stalls = 0 # times entering a level had to wait for it to load.
+        self.level = os.path.normpath(level)
+        self.current = self.load_level(self.level)
+        # the sprite atlas is shared, so loading it here means levels loaded in the background
+        # find it in the cache instead of loading images off the main thread.
+        self.current.load_sprites()
+        self.levels[self.level] = self.current
+        self.last_location = Vec2d(self.current.map_player_location.x, self.current.map_player_location.y)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __contains__(self, level):
+        return os.path.normpath(level) in self.levels
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_level(self, path):
+        return TileMap(self.drawing_surf, self.viewport_size, True, path, **self.options)
+
+    def prefetch(self, level):
+        """ starts loading a level in the background, unless it's loaded or loading already. """
+        path = os.path.normpath(level)
+        if path in self.levels or path in self.pending:
+            return
+        executor = self.executor
+        if executor is None:
+            if self.own_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.own_executor = ThreadPoolExecutor(1, thread_name_prefix="level-prefetch")
+            executor = self.own_executor
+        self.pending[path] = executor.submit(self.load_level, path)
+
+    def collect(self):
+        """ takes in the levels that finished loading in the background.
+        a level that failed to load is tried again, in the foreground, when it's entered. """
+        for path, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[path]
+            error = future.exception()
+            if error is not None:
+                self.failed[path] = error
+            else:
+                self.levels[path] = future.result()
+                self.failed.pop(path, None)
+        self.evict()
+
+    def evict(self):
+        """ drops loaded levels until they fit in memory_budget, see LevelManager. """
+        used = sum(level.memory_size() for level in self.levels.values())
+        if used <= self.memory_budget:
+            return
+        linked = {link.level for link in self.current.map_links.values()}
+        for drop_linked in (False, True):
+            for path in list(self.levels):
+                if used <= self.memory_budget:
+                    return
+                if path == self.level or (path in linked) != drop_linked:
+                    continue
+                used -= self.levels.pop(path).memory_size()
+
+    def update(self, elapsed=None):
+        """ updates the current level (see TileMap.update), takes in the levels loaded
+        in the background, starts loading the ones linked from near the player,
+        and goes through an entrance or exit once the player steps onto one.
+        returns the number of simulation steps run. """
+        steps = self.current.update(elapsed)
+        self.collect()
+        player = self.current.map_player_location
+        for link in self.current.links_near(player, self.prefetch_radius):
+            self.prefetch(link.level)
+        if not self.current.moving and (player.x, player.y) != (self.last_location.x, self.last_location.y):
+            self.last_location = Vec2d(player.x, player.y)
+            link = self.current.link_at(player)
+            if link is not None:
+                self.enter(link)
+        return steps
+
+    def enter(self, link):
+        """ goes through an entrance or exit: the level it leads to becomes current,
+        with the player on its arrival tile. that's the preloaded map when there is one,
+        otherwise it's waited for if it's still loading, or loaded right here. """
+        path = os.path.normpath(link.level)
+        if path not in self.levels:
+            self.load_stalls += 1
+            future = self.pending.pop(path, None)
+            self.failed.pop(path, None)
+            self.levels[path] = future.result() if future is not None else self.load_level(path)
+        self.levels.move_to_end(path)
+        self.level = path
+        self.current = self.levels[path]
+        if link.arrival is not None:
+            self.current.center_on(link.arrival)
+        self.current.dirty_all = True
+        player = self.current.map_player_location
+        # arriving on a tile doesn't go through it, only stepping onto one does.
+        self.last_location = Vec2d(player.x, player.y)
+        self.evict()
+        return self.current
+
+    def close(self):
+        """ stops the background thread, if there is one of our own. """
+        if self.own_executor is not None:
+            self.own_executor.shutdown(wait=False, cancel_futures=True)
+            self.own_executor = None
+        self.pending.clear()
+
+#endregion
+
+#region headless map hosting
+def map_worker(connection):
+    """ runs in a MapPool worker process: keeps the headless TileMaps of one shard by id
+    and answers the requests the pool sends down connection until it's told to stop.
+    every request gets one reply, ("ok", result) or ("error", description, traceback). """
+    maps = {}
+    while True:
+        request = connection.recv()
+        kind = request[0]
+        if kind == "stop":
+            connection.close()
+            return
+        try:
+            if kind == "create":
+                map_id, args, options = request[1:]
+                maps[map_id] = TileMap(None, *args, headless=True, **options)
+                result = None
+            elif kind == "remove":
+                maps.pop(request[1]).cancel_dungeon()
+                result = None
+            elif kind == "call":
+                map_id, method, args, options = request[1:]
+                result = getattr(maps[map_id], method)(*args, **options)
+            elif kind == "get":
+                result = getattr(maps[request[1]], request[2])
+            elif kind == "update":
+                result = {map_id: area.update(request[1]) for map_id, area in maps.items()}
+            else:
+                raise ValueError(f"unknown request {kind!r}")
+            connection.send(("ok", result))
+        except Exception as error:
+            import traceback
+            connection.send(("error", f"{type(error).__name__}: {error}", traceback.format_exc()))
+
+class MapPool:
+    """ hosts many headless TileMaps sharded across worker processes, for game servers.
+    each map lives in one worker for its whole life, the one holding the fewest maps when it was
+    created, and is reached by the id it was created with. requests to different workers
+    run in parallel: update() steps every map on every worker at once, call_many() spreads
+    a batch of calls over them. arguments and results are pickled to cross processes.
+
+        with MapPool(workers=4) as pool:
+            for i in range(200):
+                pool.create(i, seed=i, dungeon_size=Vec2d(64, 64))
+            pool.update(1 / 25)
+            path = pool.call(0, "find_path", Vec2d(1, 1), Vec2d(30, 30)) """
+    def __init__(self, workers=None, context=None):
+        if context is None:
+            import multiprocessing
+            context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for i in range(workers or os.cpu_count() or 1):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=map_worker, args=(worker_connection,),
+                name=f"tilemap-shard-{i}", daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.shards = {} # map id -> index of the worker holding it.
+        self.loads = [0] * len(self.processes) # number of maps on each worker.
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __contains__(self, map_id):
+        return map_id in self.shards
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def receive(self, shard):
+        return self.unpack_reply(shard, self.connections[shard].recv())
+
+    def unpack_reply(self, shard, reply):
+        """ what a worker's reply holds, or the error it failed with raised as a RuntimeError. """
+        if reply[0] == "error":
+            raise RuntimeError(f"map worker {shard} failed: {reply[1]}\n{reply[2]}")
+        return reply[1]
+
+    def request(self, shard, *request):
+        self.connections[shard].send(request)
+        return self.receive(shard)
+
+    def create(self, map_id, viewport_size=Vec2d(640, 480), fixed=False, **options):
+        """ makes a headless TileMap(None, viewport_size, fixed, **options) on the least loaded
+        worker. fixed defaults to False, a generated dungeon. """
+        if map_id in self.shards:
+            raise ValueError(f"map {map_id!r} already exists")
+        shard = self.loads.index(min(self.loads))
+        self.request(shard, "create", map_id, (viewport_size, fixed), options)
+        self.shards[map_id] = shard
+        self.loads[shard] += 1
+
+    def remove(self, map_id):
+        shard = self.shards.pop(map_id)
+        self.loads[shard] -= 1
+        self.request(shard, "remove", map_id)
+
+    def call(self, map_id, method, *args, **options):
+        """ calls a method of a map and returns what it returned. """
+        return self.request(self.shards[map_id], "call", map_id, method, args, options)
+
+    def get(self, map_id, attribute):
+        """ returns an attribute of a map, e.g. "map_player_location". """
+        return self.request(self.shards[map_id], "get", map_id, attribute)
+
+    def call_many(self, calls):
+        """ makes a list of calls, each (map id, method, args), sending all of them
+        before waiting for any so workers run them in parallel. returns their results in order. """
+        shards = []
+        for map_id, method, args in calls:
+            shard = self.shards[map_id]
+            self.connections[shard].send(("call", map_id, method, tuple(args), {}))
+            shards.append(shard)
+        # each worker answers in the order it was asked, so the replies can be read in order too.
+        # all of them are read before raising any error, or they'd be left in the pipes
+        # to be taken as the answers to later requests.
+        replies = [self.connections[shard].recv() for shard in shards]
+        return [self.unpack_reply(shard, reply) for shard, reply in zip(shards, replies)]
+
+    def update(self, elapsed=None):
+        """ update(elapsed) on every map, all workers at once.
+        returns {map id: simulation steps run}. """
+        for connection in self.connections:
+            connection.send(("update", elapsed))
+        replies = [connection.recv() for connection in self.connections]
+        steps = {}
+        for shard, reply in enumerate(replies):
+            steps.update(self.unpack_reply(shard, reply))
+        return steps
+
+    def close(self):
+        """ stops the workers, and with them every map they hold. """
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(("stop",))
+            process.join()
+            connection.close()
+        self.connections = []
+        self.processes = []
+        self.shards.clear()
+        self.loads = []
+#endregion